@@ -0,0 +1,652 @@
+import argparse
+import contextlib
+import glob
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from environment import LocalEnvironment
+from error import Error
+from expression import Expr, Inline
+from interpreter import Interpreter
+from optimizer import Optimizer, inlinableFunctions
+from parser import Parser, BufferParser, StreamingParser
+from plox import Lox, ENGINES, MEMOIZING_ENGINES, SCANNERS, mapFile
+from resolver import Resolver
+from scanner import Scanner, RegexScanner, BufferScanner, scanBytes, streamTokens
+from stmt import Stmt
+
+BENCH_PROGRAMS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "bench_programs"
+)
+
+
+def timeRun(run, repeat):
+    best = None
+    for _ in range(repeat):
+        Error.hadError = False
+        Error.hadRuntimeError = False
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        if Error.hadError or Error.hadRuntimeError:
+            raise Exception("Benchmark program reported an error.")
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchPrograms(args):
+    return args.programs or sorted(glob.glob(os.path.join(BENCH_PROGRAMS, "*.plox")))
+
+
+def runProgram(source, *args, **kwargs):
+    # Runs the source as a script file would be, as the whole program.
+    lox = Lox(*args, **kwargs)
+    lox.keepGlobals = False
+    lox.run(source)
+    return lox
+
+
+def benchEngines(args):
+    programs = benchPrograms(args)
+    print(f"{'program':<24}" + "".join(f"{engine:>12}" for engine in args.engines))
+    for path in programs:
+        with open(path) as f:
+            source = f.read()
+        timings = []
+        for engine in args.engines:
+            timings.append(timeRun(lambda: runProgram(source, engine), args.repeat))
+        row = f"{os.path.basename(path):<24}"
+        row += "".join(f"{timing:>11.3f}s" for timing in timings)
+        if len(timings) > 1:
+            row += "   " + " ".join(
+                f"x{timings[0] / timing:.2f}" for timing in timings[1:]
+            )
+        print(row)
+
+
+def benchEnvironments(args):
+    print(f"{'program':<24}{'environments':>14}{'time':>12}")
+    for path in benchPrograms(args):
+        with open(path) as f:
+            source = f.read()
+        LocalEnvironment.allocated = 0
+        timing = timeRun(lambda: runProgram(source, "tree"), 1)
+        print(
+            f"{os.path.basename(path):<24}{LocalEnvironment.allocated:>14}"
+            f"{timing:>11.3f}s"
+        )
+
+
+# The tree-walker with every call going through the generic callValue checks.
+class GenericCallInterpreter(Interpreter):
+    def visitCallExpr(self, expr):
+        callee = self.evaluate(expr.callee)
+        arguments = [self.evaluate(argument) for argument in expr.arguments]
+        return self.callValue(callee, arguments, expr.paren)
+
+
+# Call shapes for the call microbenchmark: declarations, then the call timed.
+CALLS = {
+    "function": ("fun add(a, b) { return a + b; }", "add(1, 2);"),
+    "closure": (
+        "fun make() { var n = 0; fun inc(by) { n = n + by; } return inc; }"
+        "var inc = make();",
+        "inc(1);",
+    ),
+    "constructor": (
+        "class Point { init(x, y) { this.x = x; this.y = y; } }",
+        "Point(1, 2);",
+    ),
+    "class without init": ("class Empty {}", "Empty();"),
+    "method": (
+        "class Bacon { eat(n) { return n; } } var bacon = Bacon();",
+        "bacon.eat(1);",
+    ),
+    "super method": (
+        "class A { m(n) { return n; } }"
+        "class B < A { m(n) { return super.m(n); } } var b = B();",
+        "b.m(1);",
+    ),
+    "native": ("", "clock();"),
+}
+
+
+def benchCalls(args):
+    print(f"{'call':<24}{'generic':>12}{'fast':>12}")
+    for name, (setup, call) in CALLS.items():
+        timings = []
+        for interpreter in (GenericCallInterpreter, Interpreter):
+            lox = Lox("tree")
+            lox.interpreter = interpreter()
+            # The calls are run after the setup, using what it declares.
+            lox.keepGlobals = True
+            lox.run(setup)
+            statements = Parser(Scanner(call).scanTokens()).parse()
+            Resolver().resolve(statements)
+            expr = statements[0].expression
+            timing = min(
+                timeit.repeat(
+                    lambda: lox.interpreter.visitCallExpr(expr),
+                    number=args.number,
+                    repeat=args.repeat,
+                )
+            )
+            timings.append(timing / args.number * 1e9)
+        print(
+            f"{name:<24}{timings[0]:>10.0f}ns{timings[1]:>10.0f}ns"
+            f"   x{timings[0] / timings[1]:.2f}"
+        )
+
+
+# Property accesses timed by the instance benchmark, on instances of a
+# class setting its fields in init.
+PROPERTIES = {
+    "get": "point.y;",
+    "set": "point.y = 4;",
+    "get method": "point.norm;",
+}
+
+
+def benchInstances(args):
+    lox = Lox("tree")
+    lox.run(
+        "class Point { init(x, y, z) { this.x = x; this.y = y; this.z = z; }"
+        "norm() { return this.x + this.y + this.z; } }"
+        "var point = Point(1, 2, 3);"
+    )
+    interpreter = lox.interpreter
+
+    def parseExpression(source):
+        statements = Parser(Scanner(source).scanTokens()).parse()
+        Resolver().resolve(statements)
+        return statements[0].expression
+
+    construct = parseExpression("Point(1, 2, 3);")
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [interpreter.evaluate(construct) for _ in range(args.instances)]
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del instances
+    print(f"{'bytes per instance':<24}{allocated / args.instances:>10.0f}")
+
+    for name, source in PROPERTIES.items():
+        expr = parseExpression(source)
+        timing = min(
+            timeit.repeat(
+                lambda: interpreter.evaluate(expr),
+                number=args.number,
+                repeat=args.repeat,
+            )
+        )
+        print(f"{name:<24}{timing / args.number * 1e9:>10.0f}ns")
+
+
+# One unit of the generated source the memory benchmark parses, `{n}` keeps
+# the names of every copy apart.
+MEMORY_UNIT = """
+class Point{n} {{
+  init(x, y) {{
+    this.x = x;
+    this.y = y;
+  }}
+
+  length() {{
+    return this.x * this.x + this.y * this.y;
+  }}
+}}
+
+fun walk{n}(steps) {{
+  var total = 0;
+  for (var i = 0; i < steps; i = i + 1) {{
+    var point = Point{n}(i, -i / 2);
+    if (point.length() > 100 and !(i == 3)) total = total + 1;
+    else total = total - point.x;
+  }}
+  print "walked " + "{n}";
+  return total;
+}}
+"""
+
+# Allocation-heavy program for the memory benchmark, every node it creates
+# stays reachable from `list` until the end.
+MEMORY_PROGRAM = """
+class Node {
+  init(value, next) {
+    this.value = value;
+    this.next = next;
+  }
+}
+
+var list = nil;
+for (var i = 0; i < %d; i = i + 1) {
+  list = Node(i, list);
+}
+"""
+
+
+def countNodes(node):
+    if isinstance(node, list):
+        return sum(countNodes(child) for child in node)
+    if isinstance(node, Inline):
+        # Its function is the declaration, counted where it is.
+        return 1 + countNodes(node.call) + countNodes(node.body)
+    if not isinstance(node, (Expr, Stmt)):
+        return 0
+    return 1 + sum(countNodes(getattr(node, name)) for name in node.__slots__)
+
+
+def traced(run):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = run()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, allocated
+
+
+def benchMemory(args):
+    source = "".join(MEMORY_UNIT.format(n=n) for n in range(args.units))
+    tokens, tokenBytes = traced(lambda: Scanner(source).scanTokens())
+    statements, nodeBytes = traced(lambda: Parser(tokens).parse())
+    Resolver().resolve(statements)
+    nodes = countNodes(statements)
+    # The AST built from a TokenBuffer holds the only Token objects.
+    buffer, bufferBytes = traced(lambda: BufferScanner(source).scanTokens())
+    _, bufferNodeBytes = traced(lambda: BufferParser(buffer).parse())
+
+    lox = Lox("tree")
+    _, instanceBytes = traced(lambda: lox.run(MEMORY_PROGRAM % args.instances))
+
+    print(f"{'source':<24}{len(source) / 1e6:>10.2f}MB")
+    print(f"{'bytes per token':<24}{tokenBytes / len(tokens):>10.0f}   {len(tokens)}")
+    print(f"{'bytes per node':<24}{nodeBytes / nodes:>10.0f}   {nodes}")
+    print(f"{'bytes per token, buffer':<24}{bufferBytes / len(buffer):>10.0f}")
+    print(f"{'bytes per node, buffer':<24}{bufferNodeBytes / nodes:>10.0f}")
+    print(
+        f"{'bytes per instance':<24}{instanceBytes / args.instances:>10.0f}"
+        f"   {args.instances}"
+    )
+
+
+def generatedSource(megabytes):
+    units = []
+    size = 0
+    while size < megabytes * 1e6:
+        units.append(MEMORY_UNIT.format(n=len(units)))
+        size += len(units[-1])
+    return "".join(units)
+
+
+def benchScanners(args):
+    source = generatedSource(args.megabytes)
+    print(f"{len(source) / 1e6:.2f}MB of generated source")
+    print(f"{'scanner':<24}{'time':>12}{'MB/s':>10}{'tokens/s':>12}")
+    reference = None
+    for name in args.scanners:
+        scanner = SCANNERS[name]
+        timing = timeRun(lambda: scanner(source).scanTokens(), args.repeat)
+        tokens = [
+            (t.type, t.lexeme, t.literal, t.line) for t in scanner(source).scanTokens()
+        ]
+        print(
+            f"{name:<24}{timing:>11.3f}s{len(source) / 1e6 / timing:>10.2f}"
+            f"{len(tokens) / timing:>12.0f}"
+        )
+        if reference is None:
+            reference = tokens
+        elif tokens != reference:
+            raise Exception("Scanners produced different tokens.")
+
+
+def parseFile(path, stream):
+    with open(path) as f:
+        if stream:
+            return StreamingParser(streamTokens(f)).parse()
+        return Parser(RegexScanner(f.read()).scanTokens()).parse()
+
+
+def benchStream(args):
+    with tempfile.NamedTemporaryFile("w", suffix=".plox", delete=False) as f:
+        f.write(generatedSource(args.megabytes))
+    try:
+        print(f"{os.path.getsize(f.name) / 1e6:.2f}MB of generated source")
+        print(f"{'parse':<24}{'peak':>12}{'AST':>12}")
+        for name, stream in (("tokens up front", False), ("streamed", True)):
+            tracemalloc.start()
+            statements = parseFile(f.name, stream)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del statements
+            print(f"{name:<24}{peak / 1e6:>10.1f}MB{current / 1e6:>10.1f}MB")
+    finally:
+        os.unlink(f.name)
+
+
+# How the mmap benchmark scans a file: read whole or memory-mapped, keeping
+# every token or only counting them as they stream by.
+SCAN_MODES = ("read", "mmap", "read, streamed", "mmap, streamed")
+
+
+def scanFile(path, mode):
+    if mode.startswith("read"):
+        with open(path) as f:
+            if mode == "read":
+                return len(RegexScanner(f.read()).scanTokens())
+            return sum(1 for token in streamTokens(f))
+    with open(path, "rb") as f, mapFile(f) as source:
+        if mode == "mmap":
+            return len(list(scanBytes(source)))
+        return sum(1 for token in scanBytes(source))
+
+
+# Runs in a fresh process for each mode, so every one gets its own peak RSS.
+def reportScan(path, mode):
+    start = time.perf_counter()
+    tokens = scanFile(path, mode)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(tokens, elapsed, peak)
+
+
+def benchMmap(args):
+    with tempfile.NamedTemporaryFile("w", suffix=".plox", delete=False) as f:
+        f.write(generatedSource(args.megabytes))
+    try:
+        print(f"{os.path.getsize(f.name) / 1e6:.2f}MB of generated source")
+        print(f"{'scan':<24}{'peak RSS':>12}{'time':>12}{'tokens':>12}")
+        for mode in SCAN_MODES:
+            result = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    f"import benchmark; benchmark.reportScan({f.name!r}, {mode!r})",
+                ],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            tokens, elapsed, peak = result.stdout.split()
+            print(
+                f"{mode:<24}{int(peak) / 1e3:>10.1f}MB{float(elapsed):>11.3f}s"
+                f"{tokens:>12}"
+            )
+    finally:
+        os.unlink(f.name)
+
+
+def timePhases(source, repeat):
+    best = [None, None, None]
+    for _ in range(repeat):
+        Error.hadError = False
+        Error.hadRuntimeError = False
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            tokens = RegexScanner(source).scanTokens()
+            scanned = time.perf_counter()
+            # Resolving counts as part of parsing.
+            statements = Parser(tokens).parse()
+            Resolver().resolve(statements)
+            parsed = time.perf_counter()
+            Interpreter().interpret(statements)
+            evaluated = time.perf_counter()
+        if Error.hadError or Error.hadRuntimeError:
+            raise Exception("Benchmark program reported an error.")
+        timings = (scanned - start, parsed - scanned, evaluated - parsed)
+        best = [t if b is None else min(b, t) for b, t in zip(best, timings)]
+    return best
+
+
+def benchPhases(args):
+    sources = []
+    for path in benchPrograms(args):
+        with open(path) as f:
+            sources.append((os.path.basename(path), f.read()))
+    sources.append((f"generated {args.megabytes}MB", generatedSource(args.megabytes)))
+    print(f"{'program':<24}{'scan':>12}{'parse':>12}{'evaluate':>12}")
+    for name, source in sources:
+        timings = timePhases(source, args.repeat)
+        print(f"{name:<24}" + "".join(f"{timing:>11.4f}s" for timing in timings))
+
+
+def benchParse(args):
+    source = generatedSource(args.megabytes)
+    print(f"{len(source) / 1e6:.2f}MB of generated source")
+    print(f"{'parser':<24}{'time':>12}{'MB/s':>10}{'tokens/s':>12}")
+    for name, scanner, parser in (
+        ("tokens", RegexScanner, Parser),
+        ("token buffer", BufferScanner, BufferParser),
+    ):
+        tokens = scanner(source).scanTokens()
+        timing = timeRun(lambda: parser(tokens).parse(), args.repeat)
+        print(
+            f"{name:<24}{timing:>11.3f}s{len(source) / 1e6 / timing:>10.2f}"
+            f"{len(tokens) / timing:>12.0f}"
+        )
+
+
+def resolvedProgram(source):
+    statements = Parser(RegexScanner(source).scanTokens()).parse()
+    resolver = Resolver()
+    resolver.resolve(statements)
+    return statements, resolver
+
+
+def benchOptimizer(args):
+    print(
+        f"{'program':<24}{'nodes':>8}{'optimized':>11}"
+        + "".join(f"{engine:>20}" for engine in args.engines)
+    )
+    for path in benchPrograms(args):
+        with open(path) as f:
+            source = f.read()
+        nodes = countNodes(resolvedProgram(source)[0])
+        lox = Lox()
+        lox.keepGlobals = False
+        optimized = countNodes(lox.optimizeProgram(*resolvedProgram(source)))
+        row = f"{os.path.basename(path):<24}{nodes:>8}{optimized:>11}"
+        for engine in args.engines:
+            before = timeRun(
+                lambda: runProgram(source, engine, optimize=False), args.repeat
+            )
+            after = timeRun(lambda: runProgram(source, engine), args.repeat)
+            row += f"{before:>8.3f}s{after:>7.3f}s x{before / after:.2f}"
+        print(row)
+
+
+# Accessor-style helpers called from a tight loop, `%d` is the iteration count.
+ACCESSORS_PROGRAM = """
+class Vector {
+  init(x, y) { this.x = x; this.y = y; }
+}
+
+fun getX(v) { return v.x; }
+fun getY(v) { return v.y; }
+fun setX(v, x) { return v.x = x; }
+fun dot(a, b) { return a.x * b.x + a.y * b.y; }
+fun square(n) { return n * n; }
+
+var position = Vector(0, 0);
+var velocity = Vector(1, 2);
+var total = 0;
+for (var i = 0; i < %d; i = i + 1) {
+  setX(position, getX(position) + getX(velocity));
+  total = total + dot(position, velocity) + square(getY(velocity));
+}
+print total;
+"""
+
+
+def benchInline(args):
+    source = ACCESSORS_PROGRAM % args.number
+
+    def run(engine, inline):
+        statements, resolver = resolvedProgram(source)
+        inlinable = inlinableFunctions(statements, resolver) if inline else None
+        statements = Optimizer(resolver.unused, inlinable).optimize(statements)
+        Lox(engine).interpreter.interpret(statements)
+
+    print(f"{'engine':<24}{'calls':>12}{'inlined':>12}")
+    for engine in args.engines:
+        called = timeRun(lambda: run(engine, False), args.repeat)
+        inlined = timeRun(lambda: run(engine, True), args.repeat)
+        print(
+            f"{engine:<24}{called:>11.3f}s{inlined:>11.3f}s   x{called / inlined:.2f}"
+        )
+
+
+# Loops recomputing expressions of values that don't change in them, and
+# statements repeating the same one, `%d` is the iteration count.
+INVARIANTS_PROGRAM = """
+fun blend(width, height, scale, offset) {
+  var total = 0;
+  for (var i = 0; i < %d; i = i + 1) {
+    var x = i - (width * scale + offset) / (height * scale - offset);
+    total = total + x * x - (width * scale + offset) * 2;
+    if (x > width * height / 2 or x < -(width * height / 2)) total = total - 1;
+  }
+  return total;
+}
+print blend(640, 480, 1.5, 12);
+"""
+
+
+def benchMemoize(args):
+    source = INVARIANTS_PROGRAM % args.number
+
+    def run(engine, memoize):
+        lox = Lox(engine)
+        lox.memoize = memoize
+        lox.run(source)
+
+    print(f"{'engine':<24}{'computed':>12}{'memoized':>12}")
+    for engine in args.engines:
+        computed = timeRun(lambda: run(engine, False), args.repeat)
+        memoized = timeRun(lambda: run(engine, True), args.repeat)
+        print(
+            f"{engine:<24}{computed:>11.3f}s{memoized:>11.3f}s"
+            f"   x{computed / memoized:.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python3 benchmark.py")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    engines = subparsers.add_parser(
+        "engines", help="compare execution engines on whole programs"
+    )
+    engines.add_argument("programs", nargs="*")
+    engines.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    engines.add_argument("--repeat", type=int, default=3)
+    engines.set_defaults(run=benchEngines)
+
+    environments = subparsers.add_parser(
+        "environments", help="count environments the tree-walker allocates"
+    )
+    environments.add_argument("programs", nargs="*")
+    environments.set_defaults(run=benchEnvironments)
+
+    calls = subparsers.add_parser(
+        "calls", help="compare the tree-walker's fast and generic call paths"
+    )
+    calls.add_argument("--number", type=int, default=20000)
+    calls.add_argument("--repeat", type=int, default=7)
+    calls.set_defaults(run=benchCalls)
+
+    instances = subparsers.add_parser(
+        "instances", help="measure instance memory and property access times"
+    )
+    instances.add_argument("--instances", type=int, default=100000)
+    instances.add_argument("--number", type=int, default=100000)
+    instances.add_argument("--repeat", type=int, default=7)
+    instances.set_defaults(run=benchInstances)
+
+    memory = subparsers.add_parser(
+        "memory", help="bytes per token and node of a large source, per instance"
+    )
+    memory.add_argument("--units", type=int, default=2000)
+    memory.add_argument("--instances", type=int, default=50000)
+    memory.set_defaults(run=benchMemory)
+
+    scanners = subparsers.add_parser(
+        "scanners", help="compare scanner throughput on a generated source"
+    )
+    scanners.add_argument("--megabytes", type=float, default=4)
+    scanners.add_argument(
+        "--scanners", nargs="+", choices=SCANNERS, default=list(SCANNERS)
+    )
+    scanners.add_argument("--repeat", type=int, default=3)
+    scanners.set_defaults(run=benchScanners)
+
+    stream = subparsers.add_parser(
+        "stream", help="peak memory of parsing a file with and without streaming"
+    )
+    stream.add_argument("--megabytes", type=float, default=1)
+    stream.set_defaults(run=benchStream)
+
+    mapped = subparsers.add_parser(
+        "mmap", help="peak RSS and time of scanning a file read or memory-mapped"
+    )
+    mapped.add_argument("--megabytes", type=float, default=16)
+    mapped.set_defaults(run=benchMmap)
+
+    phases = subparsers.add_parser(
+        "phases", help="time scanning, parsing and tree-walking separately"
+    )
+    phases.add_argument("programs", nargs="*")
+    phases.add_argument("--megabytes", type=float, default=1)
+    phases.add_argument("--repeat", type=int, default=3)
+    phases.set_defaults(run=benchPhases)
+
+    parse = subparsers.add_parser(
+        "parse", help="parser throughput on a generated source"
+    )
+    parse.add_argument("--megabytes", type=float, default=2)
+    parse.add_argument("--repeat", type=int, default=3)
+    parse.set_defaults(run=benchParse)
+
+    optimize = subparsers.add_parser(
+        "optimize", help="node counts and run times with and without the optimizer"
+    )
+    optimize.add_argument("programs", nargs="*")
+    optimize.add_argument(
+        "--engines", nargs="+", choices=ENGINES, default=list(ENGINES)
+    )
+    optimize.add_argument("--repeat", type=int, default=3)
+    optimize.set_defaults(run=benchOptimizer)
+
+    inline = subparsers.add_parser(
+        "inline", help="accessor helpers in a loop, called and inlined"
+    )
+    inline.add_argument("--number", type=int, default=20000)
+    inline.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    inline.add_argument("--repeat", type=int, default=3)
+    inline.set_defaults(run=benchInline)
+
+    memoize = subparsers.add_parser(
+        "memoize", help="loop invariant and repeated expressions, computed and kept"
+    )
+    memoize.add_argument("--number", type=int, default=20000)
+    memoize.add_argument(
+        "--engines", nargs="+", choices=MEMOIZING_ENGINES, default=MEMOIZING_ENGINES
+    )
+    memoize.add_argument("--repeat", type=int, default=3)
+    memoize.set_defaults(run=benchMemoize)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
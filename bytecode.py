@@ -0,0 +1,95 @@
+# Instruction set shared by the bytecode compiler and the VM.
+#
+# A chunk stores its instructions as a flat list of ints, every opcode is
+# followed by its operands. Alongside the code, `tokens` records the token each
+# code entry was compiled from so runtime errors can report a line, the way
+# the tree-walker does.
+
+# Operand: constant index.
+CONSTANT = 0
+NIL = 1
+TRUE = 2
+FALSE = 3
+POP = 4
+# Operand: slot relative to the frame base.
+GET_LOCAL = 5
+SET_LOCAL = 6
+# Operand: constant index of the variable name.
+GET_GLOBAL = 7
+DEFINE_GLOBAL = 8
+SET_GLOBAL = 9
+# Operand: index into the closure's upvalues.
+GET_UPVALUE = 10
+SET_UPVALUE = 11
+# Operand: constant index of the property name.
+GET_PROPERTY = 12
+SET_PROPERTY = 13
+GET_SUPER = 14
+EQUAL = 15
+NOT_EQUAL = 16
+GREATER = 17
+GREATER_EQUAL = 18
+LESS = 19
+LESS_EQUAL = 20
+ADD = 21
+SUBTRACT = 22
+MULTIPLY = 23
+DIVIDE = 24
+NOT = 25
+NEGATE = 26
+PRINT = 27
+# Operand: absolute code index to continue at.
+JUMP = 28
+JUMP_IF_FALSE = 29
+JUMP_IF_TRUE = 30
+POP_JUMP_IF_FALSE = 31
+LOOP = 32
+# Operand: argument count.
+CALL = 33
+# Operands: constant index of the method name, argument count.
+INVOKE = 34
+SUPER_INVOKE = 35
+# Operands: constant index of the function prototype, then an
+# (isLocal, index) pair for each upvalue it captures.
+CLOSURE = 36
+CLOSE_UPVALUE = 37
+RETURN = 38
+# Operands: constant index of the class name, method count, 1 if the class
+# has a superclass below its methods on the stack.
+CLASS = 39
+INHERIT = 40
+
+
+class Chunk:
+    def __init__(self):
+        self.code = []
+        self.tokens = []
+        self.constants = []
+        self.constantIndexes = {}
+
+    def write(self, token, *code):
+        self.code.extend(code)
+        self.tokens.extend([token] * len(code))
+
+    def addConstant(self, value):
+        # Only strings and numbers are deduplicated, keying on the type keeps
+        # 1.0 and True apart.
+        if isinstance(value, (str, float)):
+            key = (type(value), value)
+            if key not in self.constantIndexes:
+                self.constants.append(value)
+                self.constantIndexes[key] = len(self.constants) - 1
+            return self.constantIndexes[key]
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+
+class FunctionProto:
+    def __init__(self, name, arity):
+        self.name = name
+        self.arity = arity
+        self.upvalueCount = 0
+        self.chunk = Chunk()
+
+    def __str__(self):
+        return f"<fn {self.name}>"
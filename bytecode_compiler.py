@@ -0,0 +1,386 @@
+from bytecode import (
+    CONSTANT,
+    NIL,
+    TRUE,
+    FALSE,
+    POP,
+    GET_LOCAL,
+    SET_LOCAL,
+    GET_GLOBAL,
+    DEFINE_GLOBAL,
+    SET_GLOBAL,
+    GET_UPVALUE,
+    SET_UPVALUE,
+    GET_PROPERTY,
+    SET_PROPERTY,
+    GET_SUPER,
+    EQUAL,
+    NOT_EQUAL,
+    GREATER,
+    GREATER_EQUAL,
+    LESS,
+    LESS_EQUAL,
+    ADD,
+    SUBTRACT,
+    MULTIPLY,
+    DIVIDE,
+    NOT,
+    NEGATE,
+    PRINT,
+    JUMP,
+    JUMP_IF_FALSE,
+    JUMP_IF_TRUE,
+    POP_JUMP_IF_FALSE,
+    LOOP,
+    CALL,
+    INVOKE,
+    SUPER_INVOKE,
+    CLOSURE,
+    CLOSE_UPVALUE,
+    RETURN,
+    CLASS,
+    INHERIT,
+    FunctionProto,
+)
+from expression import Get, Super
+from resolver import FunctionType
+from token_type import TokenType
+
+BINARY_OPCODES = {
+    TokenType.BANG_EQUAL: NOT_EQUAL,
+    TokenType.EQUAL_EQUAL: EQUAL,
+    TokenType.GREATER: GREATER,
+    TokenType.GREATER_EQUAL: GREATER_EQUAL,
+    TokenType.LESS: LESS,
+    TokenType.LESS_EQUAL: LESS_EQUAL,
+    TokenType.PLUS: ADD,
+    TokenType.MINUS: SUBTRACT,
+    TokenType.STAR: MULTIPLY,
+    TokenType.SLASH: DIVIDE,
+}
+
+
+class Local:
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.isCaptured = False
+
+
+class FunctionState:
+    def __init__(self, enclosing, function, functionType):
+        self.enclosing = enclosing
+        self.function = function
+        self.functionType = functionType
+        # Slot zero holds the receiver for methods and the callee otherwise.
+        if functionType in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            self.locals = [Local("this", 0)]
+        else:
+            self.locals = [Local("", 0)]
+        self.upvalues = []
+        self.scopeDepth = 0
+
+    def resolveLocal(self, name):
+        for i in reversed(range(len(self.locals))):
+            if self.locals[i].name == name:
+                return i
+        return -1
+
+    def resolveUpvalue(self, name):
+        if self.enclosing is None:
+            return -1
+
+        local = self.enclosing.resolveLocal(name)
+        if local != -1:
+            self.enclosing.locals[local].isCaptured = True
+            return self.addUpvalue(1, local)
+
+        upvalue = self.enclosing.resolveUpvalue(name)
+        if upvalue != -1:
+            return self.addUpvalue(0, upvalue)
+        return -1
+
+    def addUpvalue(self, isLocal, index):
+        upvalue = (isLocal, index)
+        if upvalue in self.upvalues:
+            return self.upvalues.index(upvalue)
+        self.upvalues.append(upvalue)
+        return len(self.upvalues) - 1
+
+
+# Compiles a resolved program into a FunctionProto for the VM.
+#
+# The Resolver has already decided which variables are locals, anything it
+# left without a depth is a global, everything else is found by name in the
+# enclosing function's locals or captured as an upvalue.
+class BytecodeCompiler:
+    def __init__(self):
+        self.state = None
+
+    def compile(self, statements):
+        self.state = FunctionState(None, FunctionProto("script", 0), FunctionType.NONE)
+        for statement in statements:
+            statement.accept(self)
+        self.emitReturn(None)
+        return self.state.function
+
+    def emit(self, token, *code):
+        self.state.function.chunk.write(token, *code)
+
+    def emitJump(self, token, op):
+        self.emit(token, op, -1)
+        return len(self.state.function.chunk.code) - 1
+
+    def patchJump(self, operand):
+        code = self.state.function.chunk.code
+        code[operand] = len(code)
+
+    def emitReturn(self, token):
+        if self.state.functionType == FunctionType.INITIALIZER:
+            self.emit(token, GET_LOCAL, 0)
+        else:
+            self.emit(token, NIL)
+        self.emit(token, RETURN)
+
+    def makeConstant(self, value):
+        return self.state.function.chunk.addConstant(value)
+
+    def beginScope(self):
+        self.state.scopeDepth += 1
+
+    def endScope(self, token):
+        state = self.state
+        state.scopeDepth -= 1
+        while state.locals and state.locals[-1].depth > state.scopeDepth:
+            if state.locals[-1].isCaptured:
+                self.emit(token, CLOSE_UPVALUE)
+            else:
+                self.emit(token, POP)
+            state.locals.pop()
+
+    def addLocal(self, name):
+        self.state.locals.append(Local(name, self.state.scopeDepth))
+
+    def defineVariable(self, name):
+        # Locals live in the stack slot their value was pushed to.
+        if self.state.scopeDepth > 0:
+            self.addLocal(name.lexeme)
+        else:
+            self.emit(name, DEFINE_GLOBAL, self.makeConstant(name.lexeme))
+
+    def namedVariable(self, name, isLocal):
+        state = self.state
+        if isLocal:
+            slot = state.resolveLocal(name)
+            if slot != -1:
+                return GET_LOCAL, SET_LOCAL, slot
+            upvalue = state.resolveUpvalue(name)
+            if upvalue != -1:
+                return GET_UPVALUE, SET_UPVALUE, upvalue
+        return GET_GLOBAL, SET_GLOBAL, self.makeConstant(name)
+
+    def getVariable(self, token, name, isLocal):
+        get, _, operand = self.namedVariable(name, isLocal)
+        self.emit(token, get, operand)
+
+    def function(self, declaration, functionType):
+        function = FunctionProto(declaration.name.lexeme, len(declaration.params))
+        self.state = FunctionState(self.state, function, functionType)
+        self.beginScope()
+        for param in declaration.params:
+            self.addLocal(param.lexeme)
+        for statement in declaration.body:
+            statement.accept(self)
+        self.emitReturn(None)
+
+        state = self.state
+        self.state = state.enclosing
+        function.upvalueCount = len(state.upvalues)
+        captures = [operand for upvalue in state.upvalues for operand in upvalue]
+        self.emit(declaration.name, CLOSURE, self.makeConstant(function), *captures)
+
+    def visitExpressionStmt(self, stmt):
+        stmt.expression.accept(self)
+        self.emit(None, POP)
+
+    def visitPrintStmt(self, stmt):
+        stmt.expression.accept(self)
+        self.emit(None, PRINT)
+
+    def visitVarStmt(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        else:
+            self.emit(stmt.name, NIL)
+        self.defineVariable(stmt.name)
+
+    def visitBlockStmt(self, stmt):
+        self.beginScope()
+        for statement in stmt.statements:
+            statement.accept(self)
+        self.endScope(None)
+
+    def visitIfStmt(self, stmt):
+        stmt.condition.accept(self)
+        elseJump = self.emitJump(None, POP_JUMP_IF_FALSE)
+        stmt.thenBranch.accept(self)
+        if stmt.elseBranch is None:
+            self.patchJump(elseJump)
+            return
+        endJump = self.emitJump(None, JUMP)
+        self.patchJump(elseJump)
+        stmt.elseBranch.accept(self)
+        self.patchJump(endJump)
+
+    def visitWhileStmt(self, stmt):
+        loopStart = len(self.state.function.chunk.code)
+        stmt.condition.accept(self)
+        exitJump = self.emitJump(None, POP_JUMP_IF_FALSE)
+        stmt.body.accept(self)
+        self.emit(None, LOOP, loopStart)
+        self.patchJump(exitJump)
+
+    def visitFunctionStmt(self, stmt):
+        # Declare locals before compiling the body so the function can refer
+        # to itself, its closure lands in the slot reserved here.
+        if self.state.scopeDepth > 0:
+            self.addLocal(stmt.name.lexeme)
+            self.function(stmt, FunctionType.FUNCTION)
+        else:
+            self.function(stmt, FunctionType.FUNCTION)
+            self.defineVariable(stmt.name)
+
+    def visitReturnStmt(self, stmt):
+        if stmt.value is None:
+            self.emitReturn(stmt.keyword)
+        else:
+            stmt.value.accept(self)
+            self.emit(stmt.keyword, RETURN)
+
+    def visitClassStmt(self, stmt):
+        name = stmt.name
+        isLocal = self.state.scopeDepth > 0
+        if isLocal:
+            self.emit(name, NIL)
+            self.addLocal(name.lexeme)
+            classSlot = len(self.state.locals) - 1
+
+        hasSuperclass = stmt.superclass is not None
+        if hasSuperclass:
+            stmt.superclass.accept(self)
+            self.emit(stmt.superclass.name, INHERIT)
+            self.beginScope()
+            self.addLocal("super")
+
+        for method in stmt.methods:
+            functionType = FunctionType.METHOD
+            if method.name.lexeme == "init":
+                functionType = FunctionType.INITIALIZER
+            self.function(method, functionType)
+
+        self.emit(
+            name,
+            CLASS,
+            self.makeConstant(name.lexeme),
+            len(stmt.methods),
+            1 if hasSuperclass else 0,
+        )
+        if isLocal:
+            self.emit(name, SET_LOCAL, classSlot)
+            self.emit(name, POP)
+        else:
+            self.emit(name, DEFINE_GLOBAL, self.makeConstant(name.lexeme))
+
+        if hasSuperclass:
+            self.endScope(name)
+
+    def visitLiteralExpr(self, expr):
+        if expr.value is None:
+            self.emit(None, NIL)
+        elif expr.value is True:
+            self.emit(None, TRUE)
+        elif expr.value is False:
+            self.emit(None, FALSE)
+        else:
+            self.emit(None, CONSTANT, self.makeConstant(expr.value))
+
+    def visitGroupingExpr(self, expr):
+        expr.expression.accept(self)
+
+    def visitUnaryExpr(self, expr):
+        expr.right.accept(self)
+        if expr.operator.type == TokenType.MINUS:
+            self.emit(expr.operator, NEGATE)
+        else:
+            self.emit(expr.operator, NOT)
+
+    def visitBinaryExpr(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+        self.emit(expr.operator, BINARY_OPCODES[expr.operator.type])
+
+    def visitLogicalExpr(self, expr):
+        expr.left.accept(self)
+        if expr.operator.type == TokenType.OR:
+            endJump = self.emitJump(expr.operator, JUMP_IF_TRUE)
+        else:
+            endJump = self.emitJump(expr.operator, JUMP_IF_FALSE)
+        self.emit(expr.operator, POP)
+        expr.right.accept(self)
+        self.patchJump(endJump)
+
+    def visitVariableExpr(self, expr):
+        self.getVariable(expr.name, expr.name.lexeme, expr.depth is not None)
+
+    def visitAssignExpr(self, expr):
+        expr.value.accept(self)
+        _, set, operand = self.namedVariable(expr.name.lexeme, expr.depth is not None)
+        self.emit(expr.name, set, operand)
+
+    def visitThisExpr(self, expr):
+        self.getVariable(expr.keyword, "this", True)
+
+    def visitSuperExpr(self, expr):
+        self.getVariable(expr.keyword, "this", True)
+        self.getVariable(expr.keyword, "super", True)
+        self.emit(expr.method, GET_SUPER, self.makeConstant(expr.method.lexeme))
+
+    def visitGetExpr(self, expr):
+        expr.object.accept(self)
+        self.emit(expr.name, GET_PROPERTY, self.makeConstant(expr.name.lexeme))
+
+    def visitSetExpr(self, expr):
+        expr.object.accept(self)
+        expr.value.accept(self)
+        self.emit(expr.name, SET_PROPERTY, self.makeConstant(expr.name.lexeme))
+
+    def visitInlineExpr(self, expr):
+        # Compiled as the call it stands for, inlined bodies read their
+        # arguments from a list rather than the VM's stack.
+        expr.call.accept(self)
+
+    def visitCallExpr(self, expr):
+        callee = expr.callee
+        argCount = len(expr.arguments)
+        if isinstance(callee, Get):
+            # obj.method(args) calls the method with the receiver in slot
+            # zero instead of materializing a bound method first.
+            callee.object.accept(self)
+            for argument in expr.arguments:
+                argument.accept(self)
+            self.emit(expr.paren, INVOKE)
+            self.emit(callee.name, self.makeConstant(callee.name.lexeme))
+            self.emit(expr.paren, argCount)
+        elif isinstance(callee, Super):
+            self.getVariable(callee.keyword, "this", True)
+            for argument in expr.arguments:
+                argument.accept(self)
+            self.getVariable(callee.keyword, "super", True)
+            self.emit(expr.paren, SUPER_INVOKE)
+            self.emit(callee.method, self.makeConstant(callee.method.lexeme))
+            self.emit(expr.paren, argCount)
+        else:
+            callee.accept(self)
+            for argument in expr.arguments:
+                argument.accept(self)
+            self.emit(expr.paren, CALL, argCount)
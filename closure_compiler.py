@@ -0,0 +1,562 @@
+import operator
+
+from token_type import TokenType
+from error import Error
+from custom_runtime_error import CustomRuntimeError
+from environment import Environment
+from lox_callable import LoxCallable, Clock
+from lox_class import LoxClass
+from lox_instance import LoxInstance
+from interpreter import isEqual
+
+# Alternative execution engine to the tree-walking Interpreter.
+#
+# Instead of dispatching through `accept` on every evaluation, the resolved
+# AST is compiled once into a tree of specialized Python closures: operators
+# are selected and resolved depths are baked in at compile time, so running
+# a node is a single Python call.
+#
+# Expression closures take the current environment and return a value.
+# Statement closures take the current environment and return None when
+# execution falls through, or a one element tuple holding the returned value
+# when a `return` statement ran, which lets `return` unwind without raising.
+
+NUMERIC_OPERATORS = {
+    TokenType.MINUS: operator.sub,
+    TokenType.SLASH: operator.truediv,
+    TokenType.STAR: operator.mul,
+    TokenType.GREATER: operator.gt,
+    TokenType.GREATER_EQUAL: operator.ge,
+    TokenType.LESS: operator.lt,
+    TokenType.LESS_EQUAL: operator.le,
+}
+
+NIL_RETURN = (None,)
+
+
+class CompiledFunction(LoxCallable):
+    __slots__ = (
+        "declaration",
+        "params",
+        "body",
+        "closure",
+        "isInitializer",
+        "receiver",
+    )
+
+    def __init__(
+        self, declaration, params, body, closure, isInitializer, receiver=None
+    ):
+        self.declaration = declaration
+        self.params = params
+        self.body = body
+        self.closure = closure
+        self.isInitializer = isInitializer
+        self.receiver = receiver
+
+    def call(self, interpreter, arguments):
+        environment = Environment(enclosing=self.closure)
+        # Like the Resolver, methods have "this" next to their parameters.
+        if self.receiver is not None:
+            environment.values["this"] = self.receiver
+        environment.values.update(zip(self.params, arguments))
+        for statement in self.body:
+            result = statement(environment)
+            if result is not None:
+                break
+        else:
+            result = NIL_RETURN
+
+        if self.isInitializer:
+            return self.receiver
+        return result[0]
+
+    def bind(self, instance):
+        return CompiledFunction(
+            self.declaration,
+            self.params,
+            self.body,
+            self.closure,
+            self.isInitializer,
+            instance,
+        )
+
+    def arity(self):
+        return len(self.params)
+
+    def __str__(self):
+        return f"<fn {self.declaration.name.lexeme}>"
+
+
+class ClosureCompiler:
+    def __init__(self):
+        self.globals = Environment()
+        self.globals.define("clock", Clock())
+        # Holds the argument values of the inlined call whose body is being
+        # compiled, for its Parameter nodes to read.
+        self.inlineArguments = None
+
+    def interpret(self, statements):
+        program = self.compileStatements(statements)
+        try:
+            for statement in program:
+                statement(self.globals)
+        except CustomRuntimeError as err:
+            Error.runtimeError(err)
+
+    def compile(self, node):
+        return node.accept(self)
+
+    def compileStatements(self, statements):
+        return tuple(self.compile(statement) for statement in statements)
+
+    def compileFunction(self, declaration):
+        params = tuple(param.lexeme for param in declaration.params)
+        return params, self.compileStatements(declaration.body)
+
+    def compileLookup(self, expr, name, key=None):
+        if key is None:
+            key = name.lexeme
+        distance = expr.depth
+        if distance is None:
+            values = self.globals.values
+            get = self.globals.get
+
+            def globalVariable(env):
+                if key in values:
+                    return values[key]
+                return get(name)
+
+            return globalVariable
+
+        if distance == 0:
+
+            def localVariable(env):
+                return env.values.get(key)
+
+            return localVariable
+
+        if distance == 1:
+
+            def enclosingVariable(env):
+                return env.enclosing.values.get(key)
+
+            return enclosingVariable
+
+        def ancestorVariable(env):
+            return env.ancestor(distance).values.get(key)
+
+        return ancestorVariable
+
+    def visitLiteralExpr(self, expr):
+        value = expr.value
+
+        def literal(env):
+            return value
+
+        return literal
+
+    def visitGroupingExpr(self, expr):
+        # Grouping only matters to the parser, the closure of the inner
+        # expression can be used as is.
+        return self.compile(expr.expression)
+
+    def visitUnaryExpr(self, expr):
+        right = self.compile(expr.right)
+        operator_token = expr.operator
+
+        if operator_token.type == TokenType.MINUS:
+
+            def negate(env):
+                value = right(env)
+                if isinstance(value, float):
+                    return -value
+                raise CustomRuntimeError(operator_token, "Operand must be a number")
+
+            return negate
+
+        def bang(env):
+            value = right(env)
+            return value is None or value is False
+
+        return bang
+
+    def visitVariableExpr(self, expr):
+        return self.compileLookup(expr, expr.name)
+
+    def visitBinaryExpr(self, expr):
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+        operator_token = expr.operator
+        operator_type = operator_token.type
+
+        if operator_type == TokenType.PLUS:
+
+            def add(env):
+                left_value = left(env)
+                right_value = right(env)
+                if isinstance(left_value, float) and isinstance(right_value, float):
+                    return left_value + right_value
+                if isinstance(left_value, str) and isinstance(right_value, str):
+                    return left_value + right_value
+                raise CustomRuntimeError(
+                    operator_token, "Operands must be two numbers or two strings."
+                )
+
+            return add
+
+        if operator_type == TokenType.EQUAL_EQUAL:
+
+            def equal(env):
+                return isEqual(left(env), right(env))
+
+            return equal
+
+        if operator_type == TokenType.BANG_EQUAL:
+
+            def notEqual(env):
+                return not isEqual(left(env), right(env))
+
+            return notEqual
+
+        numeric_operator = NUMERIC_OPERATORS[operator_type]
+
+        def numeric(env):
+            left_value = left(env)
+            right_value = right(env)
+            if isinstance(left_value, float) and isinstance(right_value, float):
+                return numeric_operator(left_value, right_value)
+            raise CustomRuntimeError(operator_token, "Operands must be numbers.")
+
+        return numeric
+
+    def visitLogicalExpr(self, expr):
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+
+        if expr.operator.type == TokenType.OR:
+
+            def logicalOr(env):
+                value = left(env)
+                if value is None or value is False:
+                    return right(env)
+                return value
+
+            return logicalOr
+
+        def logicalAnd(env):
+            value = left(env)
+            if value is None or value is False:
+                return value
+            return right(env)
+
+        return logicalAnd
+
+    def visitSetExpr(self, expr):
+        obj = self.compile(expr.object)
+        value = self.compile(expr.value)
+        name = expr.name
+
+        def setProperty(env):
+            instance = obj(env)
+            if not isinstance(instance, LoxInstance):
+                raise CustomRuntimeError(name, "Only instances have fields.")
+            result = value(env)
+            instance.set(name, result)
+            return result
+
+        return setProperty
+
+    def visitSuperExpr(self, expr):
+        getSuperclass = self.compileLookup(expr, expr.keyword)
+        getReceiver = self.compileLookup(expr.receiver, expr.keyword, "this")
+        method_name = expr.method
+
+        def superMethod(env):
+            superclass = getSuperclass(env)
+            obj = getReceiver(env)
+            method = superclass.findMethod(method_name.lexeme)
+            if method is None:
+                raise CustomRuntimeError(
+                    method_name, f"Undefined property '{method_name.lexeme}'."
+                )
+            return method.bind(obj)
+
+        return superMethod
+
+    def visitThisExpr(self, expr):
+        return self.compileLookup(expr, expr.keyword)
+
+    def visitCallExpr(self, expr):
+        callee = self.compile(expr.callee)
+        arguments = self.compileStatements(expr.arguments)
+        paren = expr.paren
+
+        def call(env):
+            function = callee(env)
+            values = [argument(env) for argument in arguments]
+            return self.callValue(function, values, paren)
+
+        return call
+
+    def callValue(self, function, values, paren):
+        if not isinstance(function, LoxCallable):
+            raise CustomRuntimeError(paren, "Can only call functions and classes.")
+        if len(values) != function.arity():
+            raise CustomRuntimeError(
+                paren,
+                f"Expected {function.arity()} arguments but got {len(values)}.",
+            )
+        return function.call(self, values)
+
+    def visitInlineExpr(self, expr):
+        callee = self.compile(expr.call.callee)
+        arguments = self.compileStatements(expr.call.arguments)
+        paren = expr.call.paren
+        declaration = expr.function
+        # Bodies never call anything, one list per inlined call is enough.
+        inlineArguments = self.inlineArguments = [None]
+        body = self.compile(expr.body)
+
+        def inlineCall(env):
+            function = callee(env)
+            values = [argument(env) for argument in arguments]
+            if (
+                type(function) is CompiledFunction
+                and function.declaration is declaration
+                and function.receiver is None
+            ):
+                inlineArguments[0] = values
+                return body(env)
+            return self.callValue(function, values, paren)
+
+        return inlineCall
+
+    def visitParameterExpr(self, expr):
+        inlineArguments = self.inlineArguments
+        index = expr.index
+
+        def parameter(env):
+            return inlineArguments[0][index]
+
+        return parameter
+
+    def visitCachedExpr(self, expr):
+        expression = self.compile(expr.expression)
+        key = expr.variable.name.lexeme
+        distance = expr.variable.depth
+
+        def cached(env):
+            values = env.ancestor(distance).values
+            value = values[key]
+            if value is None:
+                value = values[key] = expression(env)
+            return value
+
+        return cached
+
+    def visitGetExpr(self, expr):
+        obj = self.compile(expr.object)
+        name = expr.name
+
+        def getProperty(env):
+            instance = obj(env)
+            if isinstance(instance, LoxInstance):
+                return instance.get(name)
+            raise CustomRuntimeError(name, "Only instances have properties.")
+
+        return getProperty
+
+    def visitAssignExpr(self, expr):
+        value = self.compile(expr.value)
+        name = expr.name
+        key = name.lexeme
+        distance = expr.depth
+
+        if distance is None:
+            assign = self.globals.assign
+
+            def assignGlobal(env):
+                result = value(env)
+                assign(name, result)
+                return result
+
+            return assignGlobal
+
+        if distance == 0:
+
+            def assignLocal(env):
+                result = value(env)
+                env.values[key] = result
+                return result
+
+            return assignLocal
+
+        if distance == 1:
+
+            def assignEnclosing(env):
+                result = value(env)
+                env.enclosing.values[key] = result
+                return result
+
+            return assignEnclosing
+
+        def assignAncestor(env):
+            result = value(env)
+            env.ancestor(distance).values[key] = result
+            return result
+
+        return assignAncestor
+
+    def visitExpressionStmt(self, stmt):
+        expression = self.compile(stmt.expression)
+
+        def expressionStatement(env):
+            expression(env)
+
+        return expressionStatement
+
+    def visitFunctionStmt(self, stmt):
+        params, body = self.compileFunction(stmt)
+        key = stmt.name.lexeme
+
+        def function(env):
+            env.values[key] = CompiledFunction(stmt, params, body, env, False)
+
+        return function
+
+    def visitPrintStmt(self, stmt):
+        expression = self.compile(stmt.expression)
+
+        def printStatement(env):
+            print(str(expression(env)))
+
+        return printStatement
+
+    def visitReturnStmt(self, stmt):
+        if stmt.value is None:
+
+            def returnNil(env):
+                return NIL_RETURN
+
+            return returnNil
+
+        value = self.compile(stmt.value)
+
+        def returnValue(env):
+            return (value(env),)
+
+        return returnValue
+
+    def visitWhileStmt(self, stmt):
+        condition = self.compile(stmt.condition)
+        body = self.compile(stmt.body)
+
+        def whileLoop(env):
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    return None
+                result = body(env)
+                if result is not None:
+                    return result
+
+        return whileLoop
+
+    def visitVarStmt(self, stmt):
+        key = stmt.name.lexeme
+
+        if stmt.initializer is None:
+
+            def declare(env):
+                env.values[key] = None
+
+            return declare
+
+        initializer = self.compile(stmt.initializer)
+
+        def define(env):
+            env.values[key] = initializer(env)
+
+        return define
+
+    def visitBlockStmt(self, stmt):
+        statements = self.compileStatements(stmt.statements)
+
+        if not stmt.needsEnvironment:
+
+            def inlineBlock(env):
+                for statement in statements:
+                    result = statement(env)
+                    if result is not None:
+                        return result
+
+            return inlineBlock
+
+        def block(env):
+            environment = Environment(env)
+            for statement in statements:
+                result = statement(environment)
+                if result is not None:
+                    return result
+
+        return block
+
+    def visitClassStmt(self, stmt):
+        superclass_expr = None
+        if stmt.superclass is not None:
+            superclass_expr = self.compile(stmt.superclass)
+        methods = [(method, self.compileFunction(method)) for method in stmt.methods]
+        key = stmt.name.lexeme
+
+        def classDeclaration(env):
+            superclass = None
+            if superclass_expr is not None:
+                superclass = superclass_expr(env)
+                if not isinstance(superclass, LoxClass):
+                    raise CustomRuntimeError(
+                        stmt.superclass.name, "Superclass must be a class."
+                    )
+
+            env.values[key] = None
+
+            method_env = env
+            if superclass is not None:
+                method_env = Environment(env)
+                method_env.define("super", superclass)
+
+            functions = {}
+            for method, (params, body) in methods:
+                functions[method.name.lexeme] = CompiledFunction(
+                    method,
+                    params,
+                    body,
+                    method_env,
+                    method.name.lexeme == "init",
+                )
+            env.values[key] = LoxClass(key, superclass, functions)
+
+        return classDeclaration
+
+    def visitIfStmt(self, stmt):
+        condition = self.compile(stmt.condition)
+        then_branch = self.compile(stmt.thenBranch)
+
+        if stmt.elseBranch is None:
+
+            def ifThen(env):
+                value = condition(env)
+                if value is not None and value is not False:
+                    return then_branch(env)
+
+            return ifThen
+
+        else_branch = self.compile(stmt.elseBranch)
+
+        def ifThenElse(env):
+            value = condition(env)
+            if value is not None and value is not False:
+                return then_branch(env)
+            return else_branch(env)
+
+        return ifThenElse
@@ -1,7 +1,12 @@
 from custom_runtime_error import CustomRuntimeError
 
+# Value of a global cell whose name has been seen but not defined yet.
+UNDEFINED = object()
+
 
 class Environment:
+    __slots__ = ("values", "enclosing")
+
     def __init__(self, enclosing=None):
         self.values = {}
         self.enclosing = enclosing
@@ -38,3 +43,86 @@ class Environment:
         for i in range(distance):
             environment = environment.enclosing
         return environment
+
+
+# Holds a local that a closure captured. The slot of the variable holds the
+# cell, and every closure capturing it shares the same one.
+class Cell:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+# A function, block or class scope. The Resolver gives every local a slot in
+# declaration order, and declarations run in that same order, so `define` can
+# append and reads and writes are plain list indexing.
+#
+# A function's environment doesn't link to the one it was declared in, what
+# it uses from there is reached through `upvalues`, the cells the function
+# captured. Nested block environments share their function's upvalues.
+class LocalEnvironment:
+    __slots__ = ("values", "enclosing", "upvalues")
+
+    # Number of environments created, to see the effect of block elision.
+    allocated = 0
+
+    def __init__(self, enclosing, values=None, upvalues=()):
+        LocalEnvironment.allocated += 1
+        self.values = [] if values is None else values
+        self.enclosing = enclosing
+        self.upvalues = upvalues
+
+    def define(self, name, value):
+        self.values.append(value)
+
+    def getAt(self, distance, slot):
+        environment = self
+        for i in range(distance):
+            environment = environment.enclosing
+        return environment.values[slot]
+
+    def assignAt(self, distance, slot, value):
+        environment = self
+        for i in range(distance):
+            environment = environment.enclosing
+        environment.values[slot] = value
+
+
+class GlobalCell:
+    __slots__ = ("name", "value")
+
+    def __init__(self, name):
+        self.name = name
+        self.value = UNDEFINED
+
+
+# The top-level scope. Every global name is interned to a single cell the
+# first time it is seen, so nodes can hold on to the cell and skip the lookup
+# by name. Cells outlive `define`, the REPL keeps adding to the same table.
+class GlobalEnvironment:
+    def __init__(self):
+        self.cells = {}
+        self.enclosing = None
+        self.upvalues = ()
+
+    def cell(self, name):
+        cell = self.cells.get(name)
+        if cell is None:
+            cell = self.cells[name] = GlobalCell(name)
+        return cell
+
+    def define(self, name, value):
+        self.cell(name).value = value
+
+    def assign(self, name, value):
+        cell = self.cell(name.lexeme)
+        if cell.value is UNDEFINED:
+            raise CustomRuntimeError(name, f"Undefined variable '{name.lexeme}.'")
+        cell.value = value
+
+    def get(self, name):
+        value = self.cell(name.lexeme).value
+        if value is UNDEFINED:
+            raise CustomRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+        return value
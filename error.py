@@ -1,4 +1,6 @@
-from token_type import TokenType
+from token_type import (
+    EOF,
+)
 
 
 class Error:
@@ -13,7 +15,7 @@ class Error:
         Error.hadRuntimeError = True
 
     def tokenError(token, message):
-        if token.type == TokenType.EOF:
+        if token.type == EOF:
             Error.report(token.line, " at end ", message)
         else:
             Error.report(token.line, " at '{}'".format(token.lexeme), message)
@@ -1,9 +1,18 @@
+# Nodes naming a variable, Variable, Assign, This and Super, carry where the
+# Resolver found it: `depth` counts the environments up to its declaration
+# and stays None for globals. Locals of the enclosing function are at `slot`,
+# those of outer functions are reached through `upvalue` instead, and
+# `isCell` marks locals captured by a closure, which live in cells.
 class Expr:
+    __slots__ = ()
+
     def accept(self, visitor):
         raise NotImplementedError
 
 
 class Binary(Expr):
+    __slots__ = ("left", "operator", "right")
+
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -14,6 +23,8 @@ class Binary(Expr):
 
 
 class Grouping(Expr):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -22,6 +33,8 @@ class Grouping(Expr):
 
 
 class Literal(Expr):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
@@ -30,6 +43,8 @@ class Literal(Expr):
 
 
 class Unary(Expr):
+    __slots__ = ("operator", "right")
+
     def __init__(self, operator, right):
         self.operator = operator
         self.right = right
@@ -39,23 +54,43 @@ class Unary(Expr):
 
 
 class Variable(Expr):
+    __slots__ = ("name", "depth", "slot", "upvalue", "isCell", "cell")
+
     def __init__(self, name):
         self.name = name
+        # Resolved as described on Expr.
+        self.depth = None
+        self.slot = None
+        self.upvalue = None
+        self.isCell = False
+        # Global cell, bound by the Interpreter the first time it is needed.
+        self.cell = None
 
     def accept(self, visitor):
         return visitor.visitVariableExpr(self)
 
 
 class Assign(Expr):
+    __slots__ = ("name", "value", "depth", "slot", "upvalue", "isCell", "cell")
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
+        # Resolved as described on Expr.
+        self.depth = None
+        self.slot = None
+        self.upvalue = None
+        self.isCell = False
+        # Global cell, bound by the Interpreter the first time it is needed.
+        self.cell = None
 
     def accept(self, visitor):
         return visitor.visitAssignExpr(self)
 
 
 class Logical(Expr):
+    __slots__ = ("left", "operator", "right")
+
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -66,6 +101,8 @@ class Logical(Expr):
 
 
 class Call(Expr):
+    __slots__ = ("callee", "paren", "arguments")
+
     def __init__(self, callee, paren, arguments):
         self.callee = callee
         self.paren = paren
@@ -76,36 +113,134 @@ class Call(Expr):
 
 
 class Get(Expr):
+    __slots__ = (
+        "object",
+        "name",
+        "cachedClass",
+        "cachedMethod",
+        "cachedShape",
+        "cachedIndex",
+    )
+
     def __init__(self, obj, name):
         self.object = obj
         self.name = name
+        # Inline caches, the class last seen here and the method it resolved
+        # to, and the last shape having the field and the field's index.
+        self.cachedClass = None
+        self.cachedMethod = None
+        self.cachedShape = None
+        self.cachedIndex = None
 
     def accept(self, visitor):
         return visitor.visitGetExpr(self)
 
 
 class Set(Expr):
+    __slots__ = (
+        "object",
+        "name",
+        "value",
+        "cachedShape",
+        "cachedIndex",
+        "cachedTransition",
+    )
+
     def __init__(self, obj, name, value):
         self.object = obj
         self.name = name
         self.value = value
+        # Inline cache, the shape last seen here and either the index of the
+        # field in it or the shape adding the field moves to.
+        self.cachedShape = None
+        self.cachedIndex = None
+        self.cachedTransition = None
 
     def accept(self, visitor):
         return visitor.visitSetExpr(self)
 
 
 class This(Expr):
+    __slots__ = ("keyword", "depth", "slot", "upvalue", "isCell")
+
     def __init__(self, keyword):
         self.keyword = keyword
+        # Resolved like a local named "this", see Expr.
+        self.depth = None
+        self.slot = None
+        self.upvalue = None
+        self.isCell = False
 
     def accept(self, visitor):
         return visitor.visitThisExpr(self)
 
 
 class Super(Expr):
+    __slots__ = (
+        "keyword",
+        "method",
+        "receiver",
+        "depth",
+        "slot",
+        "upvalue",
+        "isCell",
+        "cachedClass",
+        "cachedMethod",
+    )
+
     def __init__(self, keyword, method):
         self.keyword = keyword
         self.method = method
+        # Resolved separately, the instance "super" was used on.
+        self.receiver = This(keyword)
+        # Resolved like a local named "super", see Expr.
+        self.depth = None
+        self.slot = None
+        self.upvalue = None
+        self.isCell = False
+        # Inline cache, the class last seen here and the method it resolved to.
+        self.cachedClass = None
+        self.cachedMethod = None
 
     def accept(self, visitor):
         return visitor.visitSuperExpr(self)
+
+
+# Made by the Optimizer from a call of a small top-level function: `body` is
+# the expression the function returns, with Parameter nodes standing for the
+# arguments. Engines may evaluate it instead of making the call, as long as
+# the callee turns out to be the function declared by `function`.
+class Inline(Expr):
+    __slots__ = ("call", "function", "body")
+
+    def __init__(self, call, function, body):
+        self.call = call
+        self.function = function
+        self.body = body
+
+    def accept(self, visitor):
+        return visitor.visitInlineExpr(self)
+
+
+class Parameter(Expr):
+    __slots__ = ("name", "index")
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+    def accept(self, visitor):
+        return visitor.visitParameterExpr(self)
+
+
+# Made by the Memoizer from a pure expression: `variable` names the hidden
+# local keeping its value, nil until the expression is first evaluated.
+class Cached(Expr):
+    __slots__ = ("expression", "variable")
+
+    def __init__(self, expression, variable):
+        self.expression = expression
+        self.variable = variable
+
+    def accept(self, visitor):
+        return visitor.visitCachedExpr(self)
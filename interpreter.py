@@ -1,20 +1,35 @@
-from token_type import TokenType
+from token_type import (
+    MINUS,
+    PLUS,
+    SLASH,
+    STAR,
+    BANG,
+    BANG_EQUAL,
+    EQUAL_EQUAL,
+    GREATER,
+    GREATER_EQUAL,
+    LESS,
+    LESS_EQUAL,
+    AND,
+    OR,
+)
 from error import Error
 from custom_runtime_error import CustomRuntimeError
-from environment import Environment
+from expression import Get, Super
+from environment import Cell, GlobalEnvironment, LocalEnvironment, UNDEFINED
 from lox_callable import LoxCallable, Clock
 from lox_function import LoxFunction
-from return_klass import Return
 from lox_class import LoxClass
-from lox_instance import LoxInstance
+from lox_instance import DICTIONARY, NO_FIELD, LoxInstance
 
 
 class Interpreter:
     def __init__(self):
-        self.globals = Environment()
+        self.globals = GlobalEnvironment()
         self.environment = self.globals
         self.globals.define("clock", Clock())
-        self.locals = {}
+        # Argument values of the inlined call being evaluated.
+        self.inlineArguments = None
 
     def interpret(self, statements):
         try:
@@ -23,11 +38,11 @@ class Interpreter:
         except CustomRuntimeError as err:
             Error.runtimeError(err)
 
+    # Statements return None when execution falls through, or a one element
+    # tuple holding the returned value once a `return` ran, which every
+    # enclosing statement hands up to the function call without raising.
     def execute(self, stmt):
-        stmt.accept(self)
-
-    def resolve(self, expr, depth):
-        self.locals[expr] = depth
+        return stmt.accept(self)
 
     def evaluate(self, expr):
         return expr.accept(self)
@@ -42,10 +57,10 @@ class Interpreter:
         right = self.evaluate(expr.right)
 
         operator_type = expr.operator.type
-        if operator_type == TokenType.MINUS:
+        if operator_type == MINUS:
             checkNumberOperand(expr.operator, right)
             return -1 * right
-        if operator_type == TokenType.BANG:
+        if operator_type == BANG:
             return not isTruthy(right)
 
         # Unreachable
@@ -55,26 +70,37 @@ class Interpreter:
         return self.lookUpVariable(expr.name, expr)
 
     def lookUpVariable(self, name, expr):
-        distance = self.locals.get(expr)
-        if distance is not None:
-            return self.environment.getAt(distance, name.lexeme)
-        return self.globals.get(name)
+        if expr.depth is not None:
+            if expr.upvalue is not None:
+                return self.environment.upvalues[expr.upvalue].value
+            value = self.environment.getAt(expr.depth, expr.slot)
+            if expr.isCell:
+                return value.value
+            return value
+        cell = expr.cell
+        if cell is None:
+            cell = expr.cell = self.globals.cell(name.lexeme)
+        value = cell.value
+        if value is UNDEFINED:
+            # Raises the undefined variable error.
+            return self.globals.get(name)
+        return value
 
     def visitBinaryExpr(self, expr):
         left = self.evaluate(expr.left)
         right = self.evaluate(expr.right)
 
         operator_type = expr.operator.type
-        if operator_type == TokenType.MINUS:
+        if operator_type == MINUS:
             checkNumberOperands(expr.operator, left, right)
             return left - right
-        if operator_type == TokenType.SLASH:
+        if operator_type == SLASH:
             checkNumberOperands(expr.operator, left, right)
             return left / right
-        if operator_type == TokenType.STAR:
+        if operator_type == STAR:
             checkNumberOperands(expr.operator, left, right)
             return left * right
-        if operator_type == TokenType.PLUS:
+        if operator_type == PLUS:
             if isinstance(left, float) and isinstance(right, float):
                 return left + right
             if isinstance(left, str) and isinstance(right, str):
@@ -82,31 +108,31 @@ class Interpreter:
             raise CustomRuntimeError(
                 expr.operator, "Operands must be two numbers or two strings."
             )
-        if operator_type == TokenType.GREATER:
+        if operator_type == GREATER:
             checkNumberOperands(expr.operator, left, right)
             return left > right
-        if operator_type == TokenType.GREATER_EQUAL:
+        if operator_type == GREATER_EQUAL:
             checkNumberOperands(expr.operator, left, right)
             return left >= right
-        if operator_type == TokenType.LESS:
+        if operator_type == LESS:
             checkNumberOperands(expr.operator, left, right)
             return left < right
-        if operator_type == TokenType.LESS_EQUAL:
+        if operator_type == LESS_EQUAL:
             checkNumberOperands(expr.operator, left, right)
             return left <= right
-        if operator_type == TokenType.BANG_EQUAL:
+        if operator_type == BANG_EQUAL:
             return not isEqual(left, right)
-        if operator_type == TokenType.EQUAL_EQUAL:
+        if operator_type == EQUAL_EQUAL:
             return isEqual(left, right)
         # Unreachable
         return None
 
     def visitLogicalExpr(self, expr):
         left = self.evaluate(expr.left)
-        if expr.operator == TokenType.OR:
+        if expr.operator.type == OR:
             if isTruthy(left):
                 return left
-        if expr.operator == TokenType.AND:
+        if expr.operator.type == AND:
             if not isTruthy(left):
                 return left
 
@@ -118,54 +144,183 @@ class Interpreter:
             raise CustomRuntimeError(expr.name, "Only instances have fields.")
 
         value = self.evaluate(expr.value)
-        obj.set(expr.name, value)
+        shape = obj.shape
+        if shape is expr.cachedShape:
+            transition = expr.cachedTransition
+            if transition is None:
+                obj.values[expr.cachedIndex] = value
+            else:
+                obj.shape = transition
+                obj.values.append(value)
+            return value
+
+        obj.setField(expr.name.lexeme, value)
+        if shape is not DICTIONARY and obj.shape is not DICTIONARY:
+            expr.cachedShape = shape
+            if obj.shape is shape:
+                expr.cachedIndex = shape.indexes[expr.name.lexeme]
+                expr.cachedTransition = None
+            else:
+                expr.cachedTransition = obj.shape
         return value
 
     def visitSuperExpr(self, expr):
-        distance = self.locals.get(expr)
-        superclass = self.environment.getAt(distance, "super")
-        obj = self.environment.getAt(distance - 1, "this")
-
-        method = superclass.findMethod(expr.method.lexeme)
-        if method is None:
-            raise CustomRuntimeError(
-                expr.method, f"Undefined property '{expr.method.name}'."
-            )
-        return method.bind(obj)
+        superclass = self.lookUpVariable(expr.keyword, expr)
+        obj = self.lookUpVariable(expr.keyword, expr.receiver)
+        return self.cachedMethod(expr, superclass, expr.method).bind(obj)
+
+    def cachedMethod(self, expr, klass, name):
+        # Classes don't change once created, whatever was found for the class
+        # last seen at this node is still right while the class is the same.
+        if expr.cachedClass is not klass:
+            method = klass.findMethod(name.lexeme)
+            if method is None:
+                raise CustomRuntimeError(name, f"Undefined property '{name.lexeme}'.")
+            expr.cachedClass = klass
+            expr.cachedMethod = method
+        return expr.cachedMethod
 
     def visitThisExpr(self, expr):
         return self.lookUpVariable(expr.keyword, expr)
 
     def visitCallExpr(self, expr):
+        calleeType = type(expr.callee)
+        if calleeType is Get:
+            return self.invoke(expr, expr.callee)
+        if calleeType is Super:
+            return self.superInvoke(expr, expr.callee)
+
         callee = self.evaluate(expr.callee)
-        arguments = []
-        for argument in expr.arguments:
-            arguments.append(self.evaluate(argument))
+        arguments = [self.evaluate(argument) for argument in expr.arguments]
+        return self.callDirect(callee, arguments, expr.paren)
+
+    # An inlined call evaluates like the call up to the arguments, then runs the
+    # function's body in place if the callee is still that function. Bodies
+    # never call anything, so they can't be reentered while they run.
+    def visitInlineExpr(self, expr):
+        call = expr.call
+        callee = self.evaluate(call.callee)
+        arguments = [self.evaluate(argument) for argument in call.arguments]
+        if type(callee) is LoxFunction and callee.declaration is expr.function:
+            self.inlineArguments = arguments
+            return self.evaluate(expr.body)
+        return self.callDirect(callee, arguments, call.paren)
+
+    def visitParameterExpr(self, expr):
+        return self.inlineArguments[expr.index]
+
+    def visitCachedExpr(self, expr):
+        variable = expr.variable
+        value = self.environment.getAt(variable.depth, variable.slot)
+        if value is None:
+            value = self.evaluate(expr.expression)
+            self.environment.assignAt(variable.depth, variable.slot, value)
+        return value
 
+    # obj.method(args) runs the method with obj in slot 0 of its frame instead
+    # of binding it first. Errors come in the same order as evaluating the
+    # Get and then calling its result would raise them.
+    def invoke(self, expr, get):
+        obj = self.evaluate(get.object)
+        if not isinstance(obj, LoxInstance):
+            raise CustomRuntimeError(get.name, "Only instances have properties.")
+
+        # Fields shadow methods, though they seldom hold what gets invoked.
+        shape = obj.shape
+        if shape is DICTIONARY or get.name.lexeme in shape.indexes:
+            callee = obj.field(get.name.lexeme)
+            if callee is not NO_FIELD:
+                arguments = [self.evaluate(argument) for argument in expr.arguments]
+                return self.callDirect(callee, arguments, expr.paren)
+
+        method = self.cachedMethod(get, obj.klass, get.name)
+        arguments = [self.evaluate(argument) for argument in expr.arguments]
+        if len(arguments) == method.paramCount:
+            return method.callMethod(self, obj, arguments)
+        return self.callValue(method.bind(obj), arguments, expr.paren)
+
+    def superInvoke(self, expr, superExpr):
+        superclass = self.lookUpVariable(superExpr.keyword, superExpr)
+        obj = self.lookUpVariable(superExpr.keyword, superExpr.receiver)
+        method = self.cachedMethod(superExpr, superclass, superExpr.method)
+        arguments = [self.evaluate(argument) for argument in expr.arguments]
+        if len(arguments) == method.paramCount:
+            return method.callMethod(self, obj, arguments)
+        return self.callValue(method.bind(obj), arguments, expr.paren)
+
+    def callDirect(self, callee, arguments, paren):
+        # Lox functions and classes with the right number of arguments are
+        # called directly, everything else goes through the full checks.
+        calleeType = type(callee)
+        if calleeType is LoxFunction:
+            if len(arguments) == callee.paramCount:
+                return callee.call(self, arguments)
+        elif calleeType is LoxClass:
+            initializer = callee.initializer
+            if initializer is None:
+                if not arguments:
+                    return LoxInstance(callee)
+            elif len(arguments) == initializer.paramCount:
+                instance = LoxInstance(callee)
+                initializer.callMethod(self, instance, arguments)
+                return instance
+        return self.callValue(callee, arguments, paren)
+
+    def callValue(self, callee, arguments, paren):
         if not isinstance(callee, LoxCallable):
-            raise CustomRuntimeError(expr.paren, "Can only call functions and classes.")
+            raise CustomRuntimeError(paren, "Can only call functions and classes.")
 
         if len(arguments) != callee.arity():
             raise CustomRuntimeError(
-                expr.paren,
+                paren,
                 f"Expected {callee.arity()} arguments but got {len(arguments)}.",
             )
         return callee.call(self, arguments)
 
     def visitGetExpr(self, expr):
         obj = self.evaluate(expr.object)
-        if isinstance(obj, LoxInstance):
-            return obj.get(expr.name)
-
-        raise CustomRuntimeError(expr.name, "Only instances have properties.")
+        if not isinstance(obj, LoxInstance):
+            raise CustomRuntimeError(expr.name, "Only instances have properties.")
+
+        # Fields shadow methods, so they are looked at before the cache.
+        shape = obj.shape
+        if shape is expr.cachedShape:
+            return obj.values[expr.cachedIndex]
+        name = expr.name.lexeme
+        if shape is not DICTIONARY:
+            index = shape.indexes.get(name)
+            if index is not None:
+                expr.cachedShape = shape
+                expr.cachedIndex = index
+                return obj.values[index]
+        elif name in obj.fields:
+            return obj.fields[name]
+        return self.cachedMethod(expr, obj.klass, expr.name).bind(obj)
 
     def visitExpressionStmt(self, stmt):
         self.evaluate(stmt.expression)
 
     def visitFunctionStmt(self, stmt):
-        function = LoxFunction(stmt, self.environment, False)
+        if stmt.isCaptured:
+            # The function may capture itself, its cell has to exist first.
+            cell = Cell(None)
+            self.environment.define(stmt.name.lexeme, cell)
+            cell.value = LoxFunction(stmt, self.captureUpvalues(stmt), False)
+            return
+        function = LoxFunction(stmt, self.captureUpvalues(stmt), False)
         self.environment.define(stmt.name.lexeme, function)
 
+    def captureUpvalues(self, function):
+        environment = self.environment
+        return tuple(
+            (
+                environment.upvalues[index]
+                if depth is None
+                else environment.getAt(depth, index)
+            )
+            for depth, index in function.upvalues
+        )
+
     def visitPrintStmt(self, stmt):
         value = self.evaluate(stmt.expression)
         print(str(value))
@@ -174,29 +329,58 @@ class Interpreter:
         value = None
         if stmt.value is not None:
             value = self.evaluate(stmt.value)
-        raise Return(value)
+        return (value,)
 
     def visitWhileStmt(self, stmt):
         while isTruthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.body)
+            result = self.execute(stmt.body)
+            if result is not None:
+                return result
 
     def visitVarStmt(self, stmt):
         value = None
         if stmt.initializer is not None:
             value = self.evaluate(stmt.initializer)
 
+        if stmt.isCaptured:
+            value = Cell(value)
         self.environment.define(stmt.name.lexeme, value)
 
     def visitAssignExpr(self, expr):
         value = self.evaluate(expr.value)
-        distance = self.locals.get(expr)
-        if distance is not None:
-            self.environment.assignAt(distance, expr.name, value)
-        else:
+        if expr.depth is not None:
+            if expr.upvalue is not None:
+                self.environment.upvalues[expr.upvalue].value = value
+            elif expr.isCell:
+                self.environment.getAt(expr.depth, expr.slot).value = value
+            else:
+                self.environment.assignAt(expr.depth, expr.slot, value)
+            return value
+        cell = expr.cell
+        if cell is None:
+            cell = expr.cell = self.globals.cell(expr.name.lexeme)
+        if cell.value is UNDEFINED:
+            # Raises the undefined variable error.
             self.globals.assign(expr.name, value)
+        cell.value = value
+        return value
 
     def visitBlockStmt(self, stmt):
-        self.executeBlock(stmt.statements, Environment(enclosing=self.environment))
+        if stmt.needsEnvironment:
+            environment = self.environment
+            return self.executeBlock(
+                stmt.statements,
+                LocalEnvironment(environment, None, environment.upvalues),
+            )
+        # The block's locals were given the slots after the ones in use, drop
+        # them on the way out so the next declarations line up again.
+        values = self.environment.values
+        mark = len(values)
+        for statement in stmt.statements:
+            result = self.execute(statement)
+            if result is not None:
+                return result
+        del values[mark:]
 
     def visitClassStmt(self, stmt):
         superclass = None
@@ -207,17 +391,22 @@ class Interpreter:
                     stmt.superclass.name, "Superclass must be a class."
                 )
 
-        self.environment.define(stmt.name.lexeme, None)
+        cell = None
+        if stmt.isCaptured:
+            cell = Cell(None)
+            self.environment.define(stmt.name.lexeme, cell)
 
         if stmt.superclass is not None:
-            self.environment = Environment(self.environment)
-            self.environment.define("super", superclass)
+            # Only methods use "super", always through an upvalue.
+            self.environment = LocalEnvironment(
+                self.environment, [Cell(superclass)], self.environment.upvalues
+            )
 
         methods = {}
         for method in stmt.methods:
             function = LoxFunction(
                 method,
-                self.environment,
+                self.captureUpvalues(method),
                 method.name.lexeme == "init",
             )
             methods[method.name.lexeme] = function
@@ -226,20 +415,27 @@ class Interpreter:
         if superclass is not None:
             self.environment = self.environment.enclosing
 
-        self.environment.assign(stmt.name, klass)
+        if cell is not None:
+            cell.value = klass
+        else:
+            # Nothing can run between here and the methods being created, so
+            # the class can be defined once it exists, in its resolved slot.
+            self.environment.define(stmt.name.lexeme, klass)
 
     def visitIfStmt(self, stmt):
         if isTruthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.thenBranch)
+            return self.execute(stmt.thenBranch)
         elif stmt.elseBranch is not None:
-            self.execute(stmt.elseBranch)
+            return self.execute(stmt.elseBranch)
 
     def executeBlock(self, statements, environment):
         previous = self.environment
         try:
             self.environment = environment
             for stmt in statements:
-                self.execute(stmt)
+                result = self.execute(stmt)
+                if result is not None:
+                    return result
         finally:
             self.environment = previous
 
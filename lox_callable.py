@@ -1,10 +1,11 @@
 import time
 
-from return_klass import Return
 from environment import Environment
 
 
 class LoxCallable:
+    __slots__ = ()
+
     def call(self, interpreter, arguments):
         raise NotImplementedError
 
@@ -13,7 +14,7 @@ class LoxCallable:
 
 
 # Native functions
-class Clock:
+class Clock(LoxCallable):
     def call(self, interpreter, arguments):
         return time.time()
 
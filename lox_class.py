@@ -1,32 +1,41 @@
 from lox_callable import LoxCallable
-from lox_instance import LoxInstance
+from lox_instance import LoxInstance, Shape
 
 
 class LoxClass(LoxCallable):
+    __slots__ = ("name", "superclass", "methods", "initializer", "rootShape")
+
     def __init__(self, name, superclass, methods):
         self.name = name
         self.superclass = superclass
-        self.methods = methods
+        # Inherited methods are copied in and overridden by the class's own,
+        # any lookup is a single probe however deep the hierarchy is.
+        self.methods = {}
+        if superclass is not None:
+            self.methods.update(superclass.methods)
+        self.methods.update(methods)
+        # Neither the methods nor the superclass change once created.
+        self.initializer = self.findMethod("init")
+        # Subclasses share the root shape of their base class.
+        if superclass is not None:
+            self.rootShape = superclass.rootShape
+        else:
+            self.rootShape = Shape({})
 
     def call(self, interpreter, arguments):
         instance = LoxInstance(self)
-        initializer = self.findMethod("init")
+        initializer = self.initializer
         if initializer is not None:
             initializer.bind(instance).call(interpreter, arguments)
         return instance
 
     def findMethod(self, name):
-        if name in self.methods:
-            return self.methods[name]
-
-        if self.superclass is not None:
-            return self.superclass.findMethod(name)
+        return self.methods.get(name)
 
     def arity(self):
-        initializer = self.findMethod("init")
-        if initializer is None:
+        if self.initializer is None:
             return 0
-        return initializer.arity()
+        return self.initializer.arity()
 
     def __str__(self):
         return self.name
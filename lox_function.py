@@ -1,42 +1,53 @@
-from return_klass import Return
-from environment import Environment
+from environment import Cell, LocalEnvironment
 from lox_callable import LoxCallable
 
 
 class LoxFunction(LoxCallable):
-    def __init__(self, declaration, closure, isInitializer):
+    __slots__ = ("declaration", "upvalues", "isInitializer", "receiver", "paramCount")
+
+    def __init__(self, declaration, upvalues, isInitializer, receiver=None):
         self.declaration = declaration
-        self.closure = closure
+        self.upvalues = upvalues
         self.isInitializer = isInitializer
+        self.receiver = receiver
+        self.paramCount = len(declaration.params)
 
     def call(self, interpreter, arguments):
-        environment = Environment(enclosing=self.closure)
-        for i in range(len(self.declaration.params)):
-            environment.define(
-                self.declaration.params[i].lexeme,
-                arguments[i],
-            )
-        try:
-            interpreter.executeBlock(self.declaration.body, environment)
-        except Return as returnValue:
-            if self.isInitializer:
-                return self.closure.getAt(0, "this")
-            return returnValue.value
+        if self.receiver is not None:
+            return self.callMethod(interpreter, self.receiver, arguments)
+        # The argument list becomes the frame, parameters take the first slots.
+        for slot in self.declaration.cellSlots:
+            arguments[slot] = Cell(arguments[slot])
+        result = interpreter.executeBlock(
+            self.declaration.body, LocalEnvironment(None, arguments, self.upvalues)
+        )
+        if result is not None:
+            return result[0]
 
+    # Runs the method with `receiver` in slot 0, ahead of the parameters,
+    # without binding it first.
+    def callMethod(self, interpreter, receiver, arguments):
+        values = [receiver, *arguments]
+        for slot in self.declaration.cellSlots:
+            values[slot] = Cell(values[slot])
+        result = interpreter.executeBlock(
+            self.declaration.body, LocalEnvironment(None, values, self.upvalues)
+        )
         if self.isInitializer:
-            return self.closure.getAt(0, "this")
+            return receiver
+        if result is not None:
+            return result[0]
 
     def bind(self, instance):
-        environment = Environment(self.closure)
-        environment.define("this", instance)
         return LoxFunction(
             self.declaration,
-            environment,
+            self.upvalues,
             self.isInitializer,
+            instance,
         )
 
     def arity(self):
-        return len(self.declaration.params)
+        return self.paramCount
 
     def __str__(self):
         return f"<fn {self.declaration.name.lexeme}>"
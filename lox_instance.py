@@ -1,14 +1,87 @@
 from custom_runtime_error import CustomRuntimeError
 
+# Past these an object is treated as megamorphic and keeps its fields in a
+# dict: either it has grown too many fields, or instances of its class add
+# fields in so many different orders that sharing shapes stops paying off.
+MAX_FIELDS = 64
+MAX_TRANSITIONS = 32
+
+# Returned by LoxInstance.field when the instance has no such field.
+NO_FIELD = object()
+
+
+# The layout shared by instances whose fields were added in the same order:
+# `indexes` maps each field name to its position in the instance's values.
+# Adding a field moves an instance to the shape in `transitions`. Instances
+# start out from the empty root shape of their class hierarchy, see LoxClass,
+# so unrelated classes don't use up each other's transitions while code
+# inherited by subclasses still sees the one shape.
+class Shape:
+    __slots__ = ("indexes", "transitions")
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.transitions = {}
+
+    def withField(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            if (
+                len(self.indexes) >= MAX_FIELDS
+                or len(self.transitions) >= MAX_TRANSITIONS
+            ):
+                return DICTIONARY
+            indexes = dict(self.indexes)
+            indexes[name] = len(indexes)
+            shape = self.transitions[name] = Shape(indexes)
+        return shape
+
+
+# The shape of megamorphic instances, their fields live in `fields` instead.
+DICTIONARY = Shape(None)
+
 
 class LoxInstance:
+    __slots__ = ("klass", "shape", "values", "fields")
+
     def __init__(self, klass):
         self.klass = klass
-        self.fields = {}
+        self.shape = klass.rootShape
+        self.values = []
+        self.fields = None
+
+    def field(self, name):
+        shape = self.shape
+        if shape is DICTIONARY:
+            return self.fields.get(name, NO_FIELD)
+        index = shape.indexes.get(name)
+        if index is None:
+            return NO_FIELD
+        return self.values[index]
+
+    def setField(self, name, value):
+        shape = self.shape
+        if shape is DICTIONARY:
+            self.fields[name] = value
+            return
+        index = shape.indexes.get(name)
+        if index is not None:
+            self.values[index] = value
+            return
+
+        shape = shape.withField(name)
+        if shape is DICTIONARY:
+            self.fields = dict(zip(self.shape.indexes, self.values))
+            self.fields[name] = value
+            self.values = None
+        else:
+            self.values.append(value)
+        self.shape = shape
 
     def get(self, name):
-        if name.lexeme in self.fields:
-            return self.fields[name.lexeme]
+        value = self.field(name.lexeme)
+        if value is not NO_FIELD:
+            return value
 
         method = self.klass.findMethod(name.lexeme)
         if method is not None:
@@ -17,7 +90,7 @@ class LoxInstance:
         raise CustomRuntimeError(name, f"Undefined property '{name.lexeme}'.")
 
     def set(self, name, value):
-        self.fields[name.lexeme] = value
+        self.setField(name.lexeme, value)
 
     def __str__(self):
         return f"{self.klass.name} instance"
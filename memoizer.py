@@ -0,0 +1,312 @@
+from token_type import IDENTIFIER
+from token_2 import Token
+from expression import (
+    Assign,
+    Binary,
+    Cached,
+    Expr,
+    Inline,
+    Literal,
+    Logical,
+    This,
+    Unary,
+    Variable,
+)
+from stmt import Block, Class, Expression, Function, If, Print, Return, Var, While
+
+# Keeps values of pure expressions instead of computing them again: those
+# that are loop invariant are computed once per run of their loop, those
+# repeated within a statement once per run of the statement.
+#
+# Pure expressions are operators over literals and locals that nothing
+# assigns in the loop or statement. Locals a closure captured are left out,
+# calling the closure could assign them. Each value lives in a hidden local
+# declared just before the loop or statement, nil until the first Cached node
+# using it computes it, right where the expression used to be evaluated. So
+# nothing runs in a different order, and when the expression raises, it does
+# so at the same point as before. An expression is only kept when it is an
+# arithmetic, comparison or `!` operator, whose value is never nil.
+#
+# It runs on the optimized, resolved program, which has to be resolved again
+# afterwards for the hidden locals to get their slots.
+
+# Expressions smaller than this aren't worth a lookup of their own.
+MIN_NODES = 3
+
+
+def pure(expr, assigned):
+    # The node count of an expression that only reads literals and locals
+    # not in `assigned`, 0 if it reads anything else.
+    if isinstance(expr, (Literal, This)):
+        return 1
+    if isinstance(expr, Variable):
+        if (
+            expr.depth is None
+            or expr.upvalue is not None
+            or expr.isCell
+            or expr.name.lexeme in assigned
+        ):
+            return 0
+        return 1
+    if isinstance(expr, Unary):
+        size = pure(expr.right, assigned)
+        return size and size + 1
+    if isinstance(expr, (Binary, Logical)):
+        left = pure(expr.left, assigned)
+        right = pure(expr.right, assigned)
+        return left and right and left + right + 1
+    return 0
+
+
+def readsLocal(expr):
+    if isinstance(expr, (Variable, This)):
+        return True
+    return any(readsLocal(child) for child in children(expr))
+
+
+def cacheable(expr, assigned):
+    return (
+        isinstance(expr, (Binary, Unary))
+        and pure(expr, assigned) >= MIN_NODES
+        and readsLocal(expr)
+    )
+
+
+def key(expr):
+    # Equal for expressions computing the same value from the same locals.
+    if isinstance(expr, Literal):
+        return ("literal", type(expr.value), repr(expr.value))
+    if isinstance(expr, This):
+        return ("this",)
+    if isinstance(expr, Variable):
+        return ("variable", expr.name.lexeme, expr.depth, expr.slot)
+    if isinstance(expr, Unary):
+        return (expr.operator.type, key(expr.right))
+    return (expr.operator.type, key(expr.left), key(expr.right))
+
+
+def children(expr):
+    if isinstance(expr, Inline):
+        # The body reads the arguments, not locals.
+        yield expr.call
+        return
+    if isinstance(expr, Cached):
+        return
+    for name in expr.__slots__:
+        child = getattr(expr, name)
+        if isinstance(child, Expr):
+            yield child
+        elif isinstance(child, list):
+            yield from child
+
+
+def replaceChildren(expr, replace):
+    if isinstance(expr, Inline):
+        expr.call = replace(expr.call)
+        return
+    if isinstance(expr, Cached):
+        return
+    for name in expr.__slots__:
+        child = getattr(expr, name)
+        if isinstance(child, Expr):
+            setattr(expr, name, replace(child))
+        elif isinstance(child, list):
+            setattr(expr, name, [replace(item) for item in child])
+
+
+def statementExpressions(stmt):
+    # The expressions a statement evaluates itself, not in nested statements.
+    if isinstance(stmt, (Expression, Print)):
+        return [stmt.expression]
+    if isinstance(stmt, Var):
+        return [] if stmt.initializer is None else [stmt.initializer]
+    if isinstance(stmt, Return):
+        return [] if stmt.value is None else [stmt.value]
+    if isinstance(stmt, (If, While)):
+        return [stmt.condition]
+    return []
+
+
+def setStatementExpressions(stmt, expressions):
+    if isinstance(stmt, (Expression, Print)):
+        (stmt.expression,) = expressions
+    elif isinstance(stmt, Var) and stmt.initializer is not None:
+        (stmt.initializer,) = expressions
+    elif isinstance(stmt, Return) and stmt.value is not None:
+        (stmt.value,) = expressions
+    elif isinstance(stmt, (If, While)):
+        (stmt.condition,) = expressions
+
+
+def nestedStatements(stmt):
+    if isinstance(stmt, Block):
+        return stmt.statements
+    if isinstance(stmt, If):
+        if stmt.elseBranch is None:
+            return [stmt.thenBranch]
+        return [stmt.thenBranch, stmt.elseBranch]
+    if isinstance(stmt, While):
+        return [stmt.body]
+    # Functions and classes are left to their own loops and statements.
+    return []
+
+
+def assignedNames(stmt, names):
+    # Names assigned or declared anywhere in the statement, functions
+    # declared in it included.
+    if isinstance(stmt, (Var, Function, Class)):
+        names.add(stmt.name.lexeme)
+    if isinstance(stmt, Function):
+        names.update(param.lexeme for param in stmt.params)
+        for statement in stmt.body:
+            assignedNames(statement, names)
+    elif isinstance(stmt, Class):
+        for method in stmt.methods:
+            assignedNames(method, names)
+    else:
+        for expr in statementExpressions(stmt):
+            assignedInExpression(expr, names)
+        for statement in nestedStatements(stmt):
+            assignedNames(statement, names)
+    return names
+
+
+def assignedInExpression(expr, names):
+    if isinstance(expr, Assign):
+        names.add(expr.name.lexeme)
+    for child in children(expr):
+        assignedInExpression(child, names)
+    return names
+
+
+class Memoizer:
+    def __init__(self):
+        self.locals = 0
+        # What was done, for the summary.
+        self.hoisted = 0
+        self.shared = 0
+
+    def memoize(self, statements):
+        return self.memoizeStatements(statements, topLevel=True)
+
+    def summary(self):
+        lines = []
+        if self.hoisted:
+            lines.append(f"Hoisted {self.hoisted} loop invariant expression(s)")
+        if self.shared:
+            lines.append(f"Shared {self.shared} repeated expression(s)")
+        return lines
+
+    def memoizeStatements(self, statements, topLevel=False):
+        memoized = []
+        for stmt in statements:
+            declarations, stmt = self.memoizeStatement(stmt)
+            if declarations and topLevel:
+                # Hidden locals can't be globals.
+                stmt = Block(declarations + [stmt])
+            else:
+                memoized.extend(declarations)
+            memoized.append(stmt)
+        return memoized
+
+    def memoizeBranch(self, stmt):
+        declarations, stmt = self.memoizeStatement(stmt)
+        if declarations:
+            return Block(declarations + [stmt])
+        return stmt
+
+    def memoizeStatement(self, stmt):
+        # Returns the statement with the declarations of the hidden locals it
+        # uses, which go right before it.
+        declarations = []
+        if isinstance(stmt, While):
+            # Outer loops first, they keep the most.
+            self.hoist(stmt, declarations)
+            stmt.body = self.memoizeBranch(stmt.body)
+        elif isinstance(stmt, Block):
+            stmt.statements = self.memoizeStatements(stmt.statements)
+        elif isinstance(stmt, If):
+            stmt.thenBranch = self.memoizeBranch(stmt.thenBranch)
+            if stmt.elseBranch is not None:
+                stmt.elseBranch = self.memoizeBranch(stmt.elseBranch)
+        elif isinstance(stmt, Function):
+            stmt.body = self.memoizeStatements(stmt.body)
+        elif isinstance(stmt, Class):
+            for method in stmt.methods:
+                method.body = self.memoizeStatements(method.body)
+
+        if not isinstance(stmt, While):
+            self.share(stmt, declarations)
+        return declarations, stmt
+
+    def hoist(self, loop, declarations):
+        assigned = assignedNames(loop, set())
+        cached = {}
+
+        def visit(stmt):
+            setStatementExpressions(
+                stmt,
+                [
+                    self.cache(expr, assigned, None, cached, declarations)
+                    for expr in statementExpressions(stmt)
+                ],
+            )
+            for statement in nestedStatements(stmt):
+                visit(statement)
+
+        visit(loop)
+        self.hoisted += len(cached)
+
+    def share(self, stmt, declarations):
+        expressions = statementExpressions(stmt)
+        assigned = set()
+        for expr in expressions:
+            assignedInExpression(expr, assigned)
+        counts = {}
+
+        def count(expr):
+            if cacheable(expr, assigned):
+                exprKey = key(expr)
+                counts[exprKey] = counts.get(exprKey, 0) + 1
+            for child in children(expr):
+                count(child)
+
+        for expr in expressions:
+            count(expr)
+        repeated = {exprKey for exprKey, n in counts.items() if n > 1}
+        if not repeated:
+            return
+
+        cached = {}
+        setStatementExpressions(
+            stmt,
+            [
+                self.cache(expr, assigned, repeated, cached, declarations)
+                for expr in expressions
+            ],
+        )
+        self.shared += len(cached)
+
+    def cache(self, expr, assigned, wanted, cached, declarations):
+        # Replaces the outermost cacheable expressions in `wanted`, any of
+        # them when None, with Cached nodes. Equal ones share the hidden local
+        # in `cached`, whose declaration is added to `declarations`.
+        if cacheable(expr, assigned):
+            exprKey = key(expr)
+            if wanted is None or exprKey in wanted:
+                name = cached.get(exprKey)
+                if name is None:
+                    # Not an identifier, so it can't clash with a Lox name.
+                    self.locals += 1
+                    name = Token(
+                        IDENTIFIER, f"$cached{self.locals}", None, expr.operator.line
+                    )
+                    cached[exprKey] = name
+                    declarations.append(Var(name, None))
+                return Cached(expr, Variable(name))
+
+        replaceChildren(
+            expr,
+            lambda child: self.cache(child, assigned, wanted, cached, declarations),
+        )
+        return expr
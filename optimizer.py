@@ -0,0 +1,392 @@
+import copy
+import math
+
+from token_type import (
+    MINUS,
+    PLUS,
+    SLASH,
+    STAR,
+    BANG,
+    BANG_EQUAL,
+    EQUAL_EQUAL,
+    GREATER,
+    GREATER_EQUAL,
+    LESS,
+    LESS_EQUAL,
+    OR,
+)
+from expression import (
+    Assign,
+    Binary,
+    Call,
+    Expr,
+    Inline,
+    Literal,
+    Logical,
+    Parameter,
+    This,
+    Unary,
+    Variable,
+)
+from stmt import Block, Expression, Function, If, Return, While
+from interpreter import isTruthy, isEqual
+
+# Rewrites a resolved program in place before it is run: operators whose
+# operands are all literals are folded, Grouping nodes are dropped and the
+# branches of `if` and `while` statements that can never run are pruned.
+# Statements following one that never completes are unreachable and removed,
+# so are the declarations the Resolver found `unused` when nothing is lost by
+# not running them. Calls of the `inlinable` functions become Inline nodes.
+#
+# It runs after the Resolver so that static errors in code it removes are
+# still reported. Nodes it keeps hold on to their resolver annotations, but
+# once declarations are gone locals may move to other slots and the program
+# has to be resolved again. Anything that would raise a runtime error,
+# such as `-"a"` or `1 + nil`, is kept so it raises when and where it did.
+
+# Bodies of inlined functions are at most this many nodes.
+MAX_INLINE_NODES = 16
+
+NUMBER_OPERATORS = {
+    MINUS: lambda left, right: left - right,
+    SLASH: lambda left, right: left / right,
+    STAR: lambda left, right: left * right,
+    GREATER: lambda left, right: left > right,
+    GREATER_EQUAL: lambda left, right: left >= right,
+    LESS: lambda left, right: left < right,
+    LESS_EQUAL: lambda left, right: left <= right,
+}
+
+
+def foldable(value):
+    # The VM shares constants equal to each other, so 0 and -0 would end up
+    # as the same one, and the Python backend can't spell infinities.
+    if isinstance(value, float):
+        return math.isfinite(value) and (value != 0 or math.copysign(1, value) > 0)
+    return True
+
+
+def evaluateBinary(operator, left, right):
+    # Returns the folded value, or None when it can't be computed ahead of
+    # time, nil itself is never the result of a binary operator.
+    if operator == EQUAL_EQUAL:
+        return isEqual(left, right)
+    if operator == BANG_EQUAL:
+        return not isEqual(left, right)
+    if type(left) is not type(right):
+        return None
+    if operator == PLUS:
+        if isinstance(left, (float, str)):
+            return left + right
+        return None
+    if not isinstance(left, float):
+        return None
+    if operator == SLASH and right == 0:
+        return None
+    return NUMBER_OPERATORS[operator](left, right)
+
+
+def isPure(expr):
+    # Evaluating it can neither raise nor change anything. Locals are always
+    # defined, reading a global can fail.
+    if isinstance(expr, (Literal, This)):
+        return True
+    if isinstance(expr, Variable):
+        return expr.depth is not None
+    if isinstance(expr, Logical):
+        return isPure(expr.left) and isPure(expr.right)
+    if isinstance(expr, Unary):
+        return expr.operator.type == BANG and isPure(expr.right)
+    if isinstance(expr, Binary):
+        return (
+            expr.operator.type in (EQUAL_EQUAL, BANG_EQUAL)
+            and isPure(expr.left)
+            and isPure(expr.right)
+        )
+    return False
+
+
+def completes(stmt):
+    # Whether running the statement can go on to the next one.
+    if isinstance(stmt, Return):
+        return False
+    if isinstance(stmt, Block):
+        return all(completes(statement) for statement in stmt.statements)
+    if isinstance(stmt, If) and stmt.elseBranch is not None:
+        return completes(stmt.thenBranch) or completes(stmt.elseBranch)
+    if isinstance(stmt, While) and isinstance(stmt.condition, Literal):
+        return not isTruthy(stmt.condition.value)
+    return True
+
+
+def children(expr):
+    for name in expr.__slots__:
+        child = getattr(expr, name)
+        if isinstance(child, Expr):
+            yield child
+
+
+def inlineSize(expr):
+    # The number of nodes of a function body that can be inlined, or None.
+    # Bodies calling nothing can't recurse, nor run again before they're done.
+    if isinstance(expr, (Call, Inline)):
+        return None
+    if isinstance(expr, Assign) and expr.depth is not None:
+        # Parameters are values, not variables, once inlined.
+        return None
+    size = 1
+    for child in children(expr):
+        childSize = inlineSize(child)
+        if childSize is None:
+            return None
+        size += childSize
+    return size
+
+
+def inlinableFunctions(statements, resolver):
+    # Top-level functions that only return an expression and whose name is
+    # used for nothing but calling them or assigning it. The callee is still
+    # looked up and checked when an inlined call runs, since that can change
+    # what the name holds.
+    declarations = {}
+    for declaration in resolver.globalDeclarations:
+        name = declaration.name.lexeme
+        declarations[name] = declarations.get(name, 0) + 1
+
+    functions = {}
+    for stmt in statements:
+        if not isinstance(stmt, Function) or len(stmt.body) != 1:
+            continue
+        name = stmt.name.lexeme
+        (body,) = stmt.body
+        if (
+            isinstance(body, Return)
+            and body.value is not None
+            and declarations[name] == 1
+            and resolver.globalUses.get(name, 0)
+            == resolver.globalCalls.get(name, 0)
+            + resolver.globalAssignments.get(name, 0)
+        ):
+            size = inlineSize(body.value)
+            if size is not None and size <= MAX_INLINE_NODES:
+                functions[name] = stmt
+    return functions
+
+
+def substitute(expr, params):
+    # A copy of the expression with the parameters read as Parameter nodes,
+    # they are its only locals.
+    if isinstance(expr, Variable) and expr.depth is not None:
+        return Parameter(expr.name, params.index(expr.name.lexeme))
+    expr = copy.copy(expr)
+    for name in expr.__slots__:
+        child = getattr(expr, name)
+        if isinstance(child, Expr):
+            setattr(expr, name, substitute(child, params))
+    return expr
+
+
+class Optimizer:
+    def __init__(self, unused=(), inlinable=None):
+        self.unused = unused
+        self.inlinable = {} if inlinable is None else inlinable
+        # What was taken out or inlined, for the summary.
+        self.removedDeclarations = []
+        self.unreachable = 0
+        self.deadBranches = 0
+        self.inlined = {}
+
+    def optimize(self, statements):
+        return self.optimizeStatements(statements)
+
+    def summary(self):
+        lines = [
+            f"Removed unused {kind} '{name.lexeme}' [line {name.line}]"
+            for kind, name in self.removedDeclarations
+        ]
+        if self.unreachable:
+            lines.append(f"Removed {self.unreachable} unreachable statement(s)")
+        if self.deadBranches:
+            lines.append(f"Pruned {self.deadBranches} dead branch(es)")
+        for name, count in self.inlined.items():
+            lines.append(f"Inlined {count} call(s) of '{name}'")
+        return lines
+
+    def optimizeStatements(self, statements):
+        optimized = []
+        for i, statement in enumerate(statements):
+            statement = statement.accept(self)
+            if statement is None:
+                continue
+            optimized.append(statement)
+            if not completes(statement):
+                self.unreachable += len(statements) - i - 1
+                break
+        return optimized
+
+    def removeUnused(self, kind, stmt):
+        if stmt not in self.unused:
+            return False
+        self.removedDeclarations.append((kind, stmt.name))
+        return True
+
+    def optimizeBody(self, stmt):
+        # Branches and loop bodies can't be left empty.
+        stmt = stmt.accept(self)
+        if stmt is None:
+            return Block([])
+        return stmt
+
+    def visitBinaryExpr(self, expr):
+        expr.left = expr.left.accept(self)
+        expr.right = expr.right.accept(self)
+        if isinstance(expr.left, Literal) and isinstance(expr.right, Literal):
+            value = evaluateBinary(
+                expr.operator.type, expr.left.value, expr.right.value
+            )
+            if value is not None and foldable(value):
+                return Literal(value)
+        return expr
+
+    def visitGroupingExpr(self, expr):
+        return expr.expression.accept(self)
+
+    def visitLiteralExpr(self, expr):
+        return expr
+
+    def visitUnaryExpr(self, expr):
+        expr.right = expr.right.accept(self)
+        if isinstance(expr.right, Literal):
+            value = expr.right.value
+            if expr.operator.type == BANG:
+                return Literal(not isTruthy(value))
+            if isinstance(value, float) and foldable(-value):
+                return Literal(-value)
+        return expr
+
+    def visitVariableExpr(self, expr):
+        return expr
+
+    def visitAssignExpr(self, expr):
+        expr.value = expr.value.accept(self)
+        return expr
+
+    def visitLogicalExpr(self, expr):
+        expr.left = expr.left.accept(self)
+        expr.right = expr.right.accept(self)
+        if isinstance(expr.left, Literal):
+            # `or` stops at a truthy left operand, `and` at a falsey one.
+            if isTruthy(expr.left.value) == (expr.operator.type == OR):
+                return expr.left
+            return expr.right
+        return expr
+
+    def visitCallExpr(self, expr):
+        expr.callee = expr.callee.accept(self)
+        expr.arguments = [argument.accept(self) for argument in expr.arguments]
+        callee = expr.callee
+        if not isinstance(callee, Variable) or callee.depth is not None:
+            return expr
+        name = callee.name.lexeme
+        function = self.inlinable.get(name)
+        if function is None or len(function.params) != len(expr.arguments):
+            return expr
+
+        self.inlined[name] = self.inlined.get(name, 0) + 1
+        params = [param.lexeme for param in function.params]
+        body = substitute(function.body[0].value, params)
+        return Inline(expr, function, body.accept(self))
+
+    def visitInlineExpr(self, expr):
+        return expr
+
+    def visitParameterExpr(self, expr):
+        return expr
+
+    def visitGetExpr(self, expr):
+        expr.object = expr.object.accept(self)
+        return expr
+
+    def visitSetExpr(self, expr):
+        expr.object = expr.object.accept(self)
+        expr.value = expr.value.accept(self)
+        return expr
+
+    def visitSuperExpr(self, expr):
+        return expr
+
+    def visitThisExpr(self, expr):
+        return expr
+
+    def visitExpressionStmt(self, stmt):
+        stmt.expression = stmt.expression.accept(self)
+        return stmt
+
+    def visitPrintStmt(self, stmt):
+        stmt.expression = stmt.expression.accept(self)
+        return stmt
+
+    def visitVarStmt(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer = stmt.initializer.accept(self)
+        if stmt.initializer is None or isPure(stmt.initializer):
+            if self.removeUnused("variable", stmt):
+                return None
+        return stmt
+
+    def visitBlockStmt(self, stmt):
+        stmt.statements = self.optimizeStatements(stmt.statements)
+        return stmt
+
+    def visitIfStmt(self, stmt):
+        stmt.condition = stmt.condition.accept(self)
+        if isinstance(stmt.condition, Literal):
+            # A branch is a single statement, never a declaration, so it can
+            # take the place of the whole `if`.
+            if isTruthy(stmt.condition.value):
+                if stmt.elseBranch is not None:
+                    self.deadBranches += 1
+                return stmt.thenBranch.accept(self)
+            self.deadBranches += 1
+            if stmt.elseBranch is not None:
+                return stmt.elseBranch.accept(self)
+            return None
+
+        if stmt.elseBranch is not None:
+            stmt.elseBranch = stmt.elseBranch.accept(self)
+        if stmt.elseBranch is not None:
+            stmt.thenBranch = self.optimizeBody(stmt.thenBranch)
+            return stmt
+
+        stmt.thenBranch = stmt.thenBranch.accept(self)
+        if stmt.thenBranch is None:
+            # Only the condition is left to run.
+            return Expression(stmt.condition)
+        return stmt
+
+    def visitWhileStmt(self, stmt):
+        stmt.condition = stmt.condition.accept(self)
+        if isinstance(stmt.condition, Literal) and not isTruthy(stmt.condition.value):
+            self.deadBranches += 1
+            return None
+        stmt.body = self.optimizeBody(stmt.body)
+        return stmt
+
+    def visitFunctionStmt(self, stmt):
+        if self.removeUnused("function", stmt):
+            return None
+        stmt.body = self.optimizeStatements(stmt.body)
+        return stmt
+
+    def visitReturnStmt(self, stmt):
+        if stmt.value is not None:
+            stmt.value = stmt.value.accept(self)
+        return stmt
+
+    def visitClassStmt(self, stmt):
+        # Looking up the superclass can fail.
+        if stmt.superclass is None and self.removeUnused("class", stmt):
+            return None
+        for method in stmt.methods:
+            method.body = self.optimizeStatements(method.body)
+        return stmt
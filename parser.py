@@ -23,7 +23,47 @@ from expression import (
     This,
     Super,
 )
-from token_type import TokenType
+from token_type import (
+    LEFT_PAREN,
+    RIGHT_PAREN,
+    LEFT_BRACE,
+    RIGHT_BRACE,
+    COMMA,
+    DOT,
+    MINUS,
+    PLUS,
+    SEMICOLON,
+    SLASH,
+    STAR,
+    BANG,
+    BANG_EQUAL,
+    EQUAL,
+    EQUAL_EQUAL,
+    GREATER,
+    GREATER_EQUAL,
+    LESS,
+    LESS_EQUAL,
+    IDENTIFIER,
+    STRING,
+    NUMBER,
+    AND,
+    CLASS,
+    ELSE,
+    FALSE,
+    FUN,
+    FOR,
+    IF,
+    NIL,
+    OR,
+    PRINT,
+    RETURN,
+    SUPER,
+    THIS,
+    TRUE,
+    VAR,
+    WHILE,
+    EOF,
+)
 from error import Error
 
 
@@ -31,6 +71,26 @@ class ParseError(Exception):
     pass
 
 
+# The binding power of each binary operator, higher binds tighter, the one
+# its right operand is parsed at, and the node it builds. Parsing the right
+# operand one higher makes an operator left-associative, "+" and "-" group to
+# the right, as they always have here.
+BINARY_RULES = {
+    OR: (1, 2, Logical),
+    AND: (2, 3, Logical),
+    BANG_EQUAL: (3, 4, Binary),
+    EQUAL_EQUAL: (3, 4, Binary),
+    GREATER: (4, 5, Binary),
+    GREATER_EQUAL: (4, 5, Binary),
+    LESS: (4, 5, Binary),
+    LESS_EQUAL: (4, 5, Binary),
+    MINUS: (5, 5, Binary),
+    PLUS: (5, 5, Binary),
+    SLASH: (6, 7, Binary),
+    STAR: (6, 7, Binary),
+}
+
+
 class Parser:
     def __init__(self, tokens):
         self.tokens = tokens
@@ -44,114 +104,112 @@ class Parser:
 
     def declaration(self):
         try:
-            if self.match(TokenType.CLASS):
+            if self.match(CLASS):
                 return self.classDeclaration()
-            if self.match(TokenType.FUN):
+            if self.match(FUN):
                 return self.function("function")
-            if self.match(TokenType.VAR):
+            if self.match(VAR):
                 return self.varDeclaration()
             return self.statement()
         except ParseError as err:
             self.synchronize()
 
     def classDeclaration(self):
-        name = self.consume(TokenType.IDENTIFIER, "Expect class name.")
+        name = self.consume(IDENTIFIER, "Expect class name.")
         superclass = None
-        if self.match(TokenType.LESS):
-            self.consume(TokenType.IDENTIFIER, "Expect superclass name.")
+        if self.match(LESS):
+            self.consume(IDENTIFIER, "Expect superclass name.")
             superclass = Variable(self.previous())
 
-        self.consume(TokenType.LEFT_BRACE, "Expect '{' before class body.")
+        self.consume(LEFT_BRACE, "Expect '{' before class body.")
 
         methods = []
-        while not (self.check(TokenType.RIGHT_BRACE) or self.isAtEnd()):
+        while not (self.check(RIGHT_BRACE) or self.isAtEnd()):
             methods.append(self.function("method"))
 
-        self.consume(TokenType.RIGHT_BRACE, "Expect '}' after class body.")
+        self.consume(RIGHT_BRACE, "Expect '}' after class body.")
         return Class(name, superclass, methods)
 
     def function(self, kind):
-        name = self.consume(TokenType.IDENTIFIER, f"Expect {kind} name.")
-        self.consume(TokenType.LEFT_PAREN, f"Expect '(' after {kind} name.")
+        name = self.consume(IDENTIFIER, f"Expect {kind} name.")
+        self.consume(LEFT_PAREN, f"Expect '(' after {kind} name.")
         parameters = []
-        if not self.check(TokenType.RIGHT_PAREN):
+        if not self.check(RIGHT_PAREN):
             while True:
                 if len(parameters) > 255:
                     self.error(self.peek(), "Can't have more than 255 parameters.")
-                parameters.append(
-                    self.consume(TokenType.IDENTIFIER, "Expect parameter name.")
-                )
-                if not self.match(TokenType.COMMA):
+                parameters.append(self.consume(IDENTIFIER, "Expect parameter name."))
+                if not self.match(COMMA):
                     break
-        self.consume(TokenType.RIGHT_PAREN, "Expect ')' after parameters.")
+        self.consume(RIGHT_PAREN, "Expect ')' after parameters.")
 
-        self.consume(TokenType.LEFT_BRACE, f"Expect '{{' before {kind} body.")
+        self.consume(LEFT_BRACE, f"Expect '{{' before {kind} body.")
         body = self.block()
         return Function(name, parameters, body)
 
     def varDeclaration(self):
-        name = self.consume(TokenType.IDENTIFIER, "Expect variable name.")
+        name = self.consume(IDENTIFIER, "Expect variable name.")
 
         initializer = None
-        if self.match(TokenType.EQUAL):
+        if self.match(EQUAL):
             initializer = self.expression()
-        self.consume(TokenType.SEMICOLON, "Expect ';' after expression.")
+        self.consume(SEMICOLON, "Expect ';' after expression.")
         return Var(name, initializer)
 
     def statement(self):
-        if self.match(TokenType.IF):
+        if self.match(IF):
             return self.ifStatement()
 
-        if self.match(TokenType.FOR):
+        if self.match(FOR):
             return self.forStatement()
 
-        if self.match(TokenType.PRINT):
+        if self.match(PRINT):
             return self.printStatement()
 
-        if self.match(TokenType.RETURN):
+        if self.match(RETURN):
             return self.returnStatement()
 
-        if self.match(TokenType.WHILE):
+        if self.match(WHILE):
             return self.whileStatement()
 
-        if self.match(TokenType.LEFT_BRACE):
+        if self.match(LEFT_BRACE):
             return Block(self.block())
 
         return self.expressionStatement()
 
     def ifStatement(self):
-        self.consume(TokenType.LEFT_PAREN, "Expect '(' after 'if'.")
+        self.consume(LEFT_PAREN, "Expect '(' after 'if'.")
         condition = self.expression()
-        self.consume(TokenType.RIGHT_PAREN, "Expect ')' after if condition.")
+        self.consume(RIGHT_PAREN, "Expect ')' after if condition.")
 
         thenBranch = self.statement()
         elseBranch = None
-        if self.match(TokenType.ELSE):
+        if self.match(ELSE):
             elseBranch = self.statement()
 
         return If(condition, thenBranch, elseBranch)
 
     def forStatement(self):
-        self.consume(TokenType.LEFT_PAREN, "Expect '(' after 'for'.")
+        self.consume(LEFT_PAREN, "Expect '(' after 'for'.")
         # Initializer clause
-        if self.match(TokenType.SEMICOLON):
+        if self.match(SEMICOLON):
             initializer = None
-        elif self.match(TokenType.VAR):
+        elif self.match(VAR):
             initializer = self.varDeclaration()
         else:
             initializer = self.expressionStatement()
 
         # Condition clause
         condition = None
-        if not self.check(TokenType.SEMICOLON):
+        if not self.check(SEMICOLON):
             condition = self.expression()
-        self.consume(TokenType.SEMICOLON, "Expect ';' after loop condition.")
+        self.consume(SEMICOLON, "Expect ';' after loop condition.")
 
         # Increment clause
         increment = None
-        if not self.check(TokenType.RIGHT_PAREN):
+        if not self.check(RIGHT_PAREN):
             increment = self.expression()
-        self.consume(TokenType.RIGHT_PAREN, "Expect ')' after for clauses.")
+        self.consume(RIGHT_PAREN, "Expect ')' after for clauses.")
 
         body = self.statement()
 
@@ -169,44 +227,44 @@ class Parser:
         return body
 
     def whileStatement(self):
-        self.consume(TokenType.LEFT_PAREN, "Expect '(' after 'while'.")
+        self.consume(LEFT_PAREN, "Expect '(' after 'while'.")
         condition = self.expression()
-        self.consume(TokenType.RIGHT_PAREN, "Expect ')' after condition.")
+        self.consume(RIGHT_PAREN, "Expect ')' after condition.")
         body = self.statement()
 
         return While(condition, body)
 
     def printStatement(self):
         value = self.expression()
-        self.consume(TokenType.SEMICOLON, "Expect ';' after expression.")
+        self.consume(SEMICOLON, "Expect ';' after expression.")
         return Print(value)
 
     def returnStatement(self):
         keyword = self.previous()
         value = None
-        if not self.check(TokenType.SEMICOLON):
+        if not self.check(SEMICOLON):
             value = self.expression()
-        self.consume(TokenType.SEMICOLON, "Expect ';' after return value.")
+        self.consume(SEMICOLON, "Expect ';' after return value.")
         return Return(keyword, value)
 
     def expressionStatement(self):
         expr = self.expression()
-        self.consume(TokenType.SEMICOLON, "Expect ';' after expression.")
+        self.consume(SEMICOLON, "Expect ';' after expression.")
         return Expression(expr)
 
     def block(self):
         statements = []
-        while not self.check(TokenType.RIGHT_BRACE) and not self.isAtEnd():
+        while not self.check(RIGHT_BRACE) and not self.isAtEnd():
             statements.append(self.declaration())
-        self.consume(TokenType.RIGHT_BRACE, "Expect '}' after block.")
+        self.consume(RIGHT_BRACE, "Expect '}' after block.")
         return statements
 
     def expression(self):
         return self.assignment()
 
     def assignment(self):
-        expr = self._or()
-        if self.match(TokenType.EQUAL):
+        expr = self.binary(0)
+        if self.match(EQUAL):
             equals = self.previous()
             value = self.assignment()
             if isinstance(expr, Variable):
@@ -217,61 +275,18 @@ class Parser:
             self.error(equals, "Invalid assignment target.")
         return expr
 
-    def _or(self):
-        expr = self._and()
-        while self.match(TokenType.OR):
-            operator = self.previous()
-            right = self._and()
-            expr = Logical(expr, operator, right)
-        return expr
-
-    def _and(self):
-        expr = self.equality()
-        while self.match(TokenType.AND):
-            operator = self.previous()
-            right = self.equality()
-            expr = Logical(expr, operator, right)
-        return expr
-
-    def equality(self):
-        expr = self.comparison()
-        while self.match(TokenType.BANG_EQUAL, TokenType.EQUAL_EQUAL):
-            operator = self.previous()
-            right = self.comparison()
-            expr = Binary(expr, operator, right)
-        return expr
-
-    def comparison(self):
-        expr = self.term()
-        while self.match(
-            TokenType.GREATER,
-            TokenType.GREATER_EQUAL,
-            TokenType.LESS,
-            TokenType.LESS_EQUAL,
-        ):
-            operator = self.previous()
-            right = self.term()
-            expr = Binary(expr, operator, right)
-        return expr
-
-    def term(self):
-        expr = self.factor()
-        while self.match(TokenType.MINUS, TokenType.PLUS):
-            operator = self.previous()
-            right = self.term()
-            expr = Binary(expr, operator, right)
-        return expr
-
-    def factor(self):
+    def binary(self, minPower):
         expr = self.unary()
-        while self.match(TokenType.SLASH, TokenType.STAR):
-            operator = self.previous()
-            right = self.unary()
-            expr = Binary(expr, operator, right)
-        return expr
+        while True:
+            rule = BINARY_RULES.get(self.peekType())
+            if rule is None or rule[0] < minPower:
+                return expr
+            operator = self.advance()
+            right = self.binary(rule[1])
+            expr = rule[2](expr, operator, right)
 
     def unary(self):
-        if self.match(TokenType.BANG, TokenType.MINUS):
+        if self.match(BANG, MINUS):
             operator = self.previous()
             right = self.unary()
             return Unary(operator, right)
@@ -280,12 +295,13 @@ class Parser:
     def call(self):
         expr = self.primary()
         while True:
-            if self.match(TokenType.LEFT_PAREN):
+            tokenType = self.peekType()
+            if tokenType == LEFT_PAREN:
+                self.advance()
                 expr = self.finishCall(expr)
-            elif self.match(TokenType.DOT):
-                name = self.consume(
-                    TokenType.IDENTIFIER, "Expect property name after '.'."
-                )
+            elif tokenType == DOT:
+                self.advance()
+                name = self.consume(IDENTIFIER, "Expect property name after '.'.")
                 expr = Get(expr, name)
             else:
                 break
@@ -293,40 +309,44 @@ class Parser:
 
     def finishCall(self, callee):
         arguments = []
-        if not self.check(TokenType.RIGHT_PAREN):
+        if not self.check(RIGHT_PAREN):
             while True:
                 if len(arguments) > 255:
                     self.error(self.peek(), "Can't have more than 255 arguments.")
                 arguments.append(self.expression())
-                if not self.match(TokenType.COMMA):
+                if not self.match(COMMA):
                     break
 
-        paren = self.consume(TokenType.RIGHT_PAREN, "Expect ')' after arguments.")
+        paren = self.consume(RIGHT_PAREN, "Expect ')' after arguments.")
         return Call(callee, paren, arguments)
 
     def primary(self):
-        if self.match(TokenType.FALSE):
+        # One look at the token picks the rule, EOF matches none of them.
+        tokenType = self.peekType()
+        if tokenType == IDENTIFIER:
+            return Variable(self.advance())
+        if tokenType == NUMBER or tokenType == STRING:
+            return Literal(self.advance().literal)
+        if tokenType == FALSE:
+            self.advance()
             return Literal(False)
-        if self.match(TokenType.TRUE):
+        if tokenType == TRUE:
+            self.advance()
             return Literal(True)
-        if self.match(TokenType.NIL):
+        if tokenType == NIL:
+            self.advance()
             return Literal(None)
-        if self.match(TokenType.NUMBER, TokenType.STRING):
-            return Literal(self.previous().literal)
-        if self.match(TokenType.SUPER):
-            keyword = self.previous()
-            self.consume(TokenType.DOT, "Expect ',' after 'super',")
-            method = self.consume(
-                TokenType.IDENTIFIER, "Exxpect superclass method name."
-            )
+        if tokenType == THIS:
+            return This(self.advance())
+        if tokenType == SUPER:
+            keyword = self.advance()
+            self.consume(DOT, "Expect ',' after 'super',")
+            method = self.consume(IDENTIFIER, "Exxpect superclass method name.")
             return Super(keyword, method)
-        if self.match(TokenType.THIS):
-            return This(self.previous())
-        if self.match(TokenType.IDENTIFIER):
-            return Variable(self.previous())
-        if self.match(TokenType.LEFT_PAREN):
+        if tokenType == LEFT_PAREN:
+            self.advance()
             expr = self.expression()
-            self.consume(TokenType.RIGHT_PAREN, "Expect ')' after expression.")
+            self.consume(RIGHT_PAREN, "Expect ')' after expression.")
             return Grouping(expr)
 
         raise self.error(self.peek(), "Expect expression.")
@@ -337,16 +357,15 @@ class Parser:
         raise self.error(self.peek(), message)
 
     def match(self, *token_types):
-        for t in token_types:
-            if self.check(t):
-                self.advance()
-                return True
+        tokenType = self.peekType()
+        if tokenType in token_types and tokenType != EOF:
+            self.advance()
+            return True
         return False
 
     def check(self, token_type):
-        if self.isAtEnd():
-            return False
-        return self.peek().type == token_type
+        tokenType = self.peekType()
+        return tokenType == token_type and tokenType != EOF
 
     def advance(self):
         if not self.isAtEnd():
@@ -354,11 +373,14 @@ class Parser:
         return self.previous()
 
     def isAtEnd(self):
-        return self.peek().type == TokenType.EOF
+        return self.peekType() == EOF
 
     def peek(self):
         return self.tokens[self.current]
 
+    def peekType(self):
+        return self.tokens[self.current].type
+
     def previous(self):
         return self.tokens[self.current - 1]
 
@@ -370,18 +392,69 @@ class Parser:
         self.advance()
 
         while not self.isAtEnd():
-            if self.previous().type == TokenType.SEMICOLON:
+            if self.previous().type == SEMICOLON:
                 return
             if self.peek().type in [
-                TokenType.CLASS,
-                TokenType.FUN,
-                TokenType.VAR,
-                TokenType.FOR,
-                TokenType.IF,
-                TokenType.WHILE,
-                TokenType.PRINT,
-                TokenType.RETURN,
+                CLASS,
+                FUN,
+                VAR,
+                FOR,
+                IF,
+                WHILE,
+                PRINT,
+                RETURN,
             ]:
                 return
 
             self.advance()
+
+
+# Parses tokens as an iterator yields them, streamTokens reading a file for
+# one. The Parser never looks further than the current token and the one
+# before it, so those two are all that is kept.
+class StreamingParser(Parser):
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.currentToken = next(self.tokens)
+        self.previousToken = None
+
+    def advance(self):
+        if not self.isAtEnd():
+            self.previousToken = self.currentToken
+            self.currentToken = next(self.tokens)
+        return self.previousToken
+
+    def peek(self):
+        return self.currentToken
+
+    def peekType(self):
+        return self.currentToken.type
+
+    def previous(self):
+        return self.previousToken
+
+
+# Parses a TokenBuffer in place. Kinds are checked in the buffer's array,
+# Tokens are only built for what `previous` and `peek` return, so `match`
+# skips over tokens without going through `advance`.
+class BufferParser(Parser):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.kinds = tokens.kinds
+        self.current = 0
+
+    def match(self, *token_types):
+        kind = self.kinds[self.current]
+        if kind in token_types and kind != EOF:
+            self.current += 1
+            return True
+        return False
+
+    def peek(self):
+        return self.tokens.token(self.current)
+
+    def peekType(self):
+        return self.kinds[self.current]
+
+    def previous(self):
+        return self.tokens.token(self.current - 1)
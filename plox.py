@@ -1,48 +1,189 @@
 import sys
+import argparse
+import contextlib
+import mmap
+import os
 from error import Error
 from ast_printer import AstPrinter
-from scanner import Scanner
-from parser import Parser
+from scanner import (
+    Scanner,
+    RegexScanner,
+    BufferScanner,
+    TokenBuffer,
+    scanBytes,
+    streamTokens,
+)
+from parser import Parser, BufferParser, StreamingParser
 from interpreter import Interpreter
+from closure_compiler import ClosureCompiler
+from vm import VM
+from python_compiler import PythonCompiler
 from resolver import Resolver
+from optimizer import Optimizer, inlinableFunctions
+from memoizer import Memoizer
+
+ENGINES = {
+    "tree": Interpreter,
+    "closure": ClosureCompiler,
+    "vm": VM,
+    "python": PythonCompiler,
+}
+
+# Engines that evaluate the Memoizer's Cached nodes. The VM and the Python
+# backend already keep locals in registers and fast variables, a lookup of a
+# hidden local costs them about as much as the expression it stands for.
+MEMOIZING_ENGINES = ("tree", "closure")
+
+# All produce the same tokens, "char" is the character at a time reference
+# and "buffer" keeps them in a TokenBuffer rather than a list.
+SCANNERS = {
+    "regex": RegexScanner,
+    "char": Scanner,
+    "buffer": BufferScanner,
+}
+
+
+class ArgumentParser(argparse.ArgumentParser):
+    def error(self, message):
+        self.print_usage()
+        sys.exit(64)
+
+
+def parseArgs(argv):
+    parser = ArgumentParser(prog="python3 plox.py")
+    parser.add_argument("script", nargs="?")
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="tree",
+        help="execution engine used to run the resolved program",
+    )
+    parser.add_argument(
+        "--scanner",
+        choices=SCANNERS,
+        default="regex",
+        help="scanner used to tokenize the source",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="scan the script while parsing it instead of up front, "
+        "always with the regex scanner",
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="memory-map the script and scan its bytes instead of decoding it "
+        "whole, always with the regex scanner",
+    )
+    parser.add_argument(
+        "--optimize",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="fold constants and remove dead code before running the program",
+    )
+    parser.add_argument(
+        "--report-removed",
+        action="store_true",
+        help="print what the optimizer removed, inlined and memoized to stderr",
+    )
+    return parser.parse_args(argv)
+
+
+def mapFile(f):
+    # Empty files can't be mapped.
+    if os.fstat(f.fileno()).st_size == 0:
+        return contextlib.nullcontext(b"")
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
 
 class Lox:
-    def __init__(self):
-        self.interpreter = Interpreter()
-        if sys.version_info[0] < 3:
-            raise Exception("Python 3 or a more recent version is required.")
-        if len(sys.argv) > 2:
-            print("Usage: python3 plox.py [script]")
-            sys.exit(64)
-        elif len(sys.argv) > 1:
-            self.runFile(sys.argv[1])
-        else:
-            self.runPrompt()
+    def __init__(self, engine="tree", scanner="regex", optimize=True, report=False):
+        self.interpreter = ENGINES[engine]()
+        self.scanner = SCANNERS[scanner]
+        self.optimize = optimize
+        self.memoize = engine in MEMOIZING_ENGINES
+        self.report = report
+        # Top-level declarations are only unused if no later run can see them,
+        # which is only known when running a script file.
+        self.keepGlobals = True
 
     def run(self, line):
-        scanner = Scanner(line)
+        scanner = self.scanner(line)
         tokens = scanner.scanTokens()
-        parser = Parser(tokens)
+        if isinstance(tokens, TokenBuffer):
+            self.runParser(BufferParser(tokens))
+        else:
+            self.runParser(Parser(tokens))
+
+    def runParser(self, parser):
         statements = parser.parse()
         if Error.hadError:
             return
 
-        resolver = Resolver(self.interpreter)
+        resolver = Resolver()
         resolver.resolve(statements)
         if Error.hadError:
             return
 
+        if self.optimize:
+            statements = self.optimizeProgram(statements, resolver)
         self.interpreter.interpret(statements)
 
-    def runFile(self, filePath):
-        with open(filePath) as f:
-            read_data = f.read()
-            self.run(read_data)
-            if Error.hadError:
-                sys.exit(65)
-            if Error.hadRuntimeError:
-                sys.exit(70)
+    def optimizeProgram(self, statements, resolver):
+        optimizer = Optimizer()
+        while True:
+            optimizer.unused = resolver.unused
+            if not self.keepGlobals:
+                optimizer.unused = optimizer.unused.union(resolver.unusedGlobals())
+            optimizer.inlinable = inlinableFunctions(statements, resolver)
+            removed = len(optimizer.removedDeclarations)
+            statements = optimizer.optimize(statements)
+            if len(optimizer.removedDeclarations) == removed:
+                break
+            # Locals move to other slots, and what only the removed
+            # declarations used may now be unused as well.
+            resolver = Resolver()
+            resolver.resolve(statements)
+        summary = optimizer.summary()
+
+        if self.memoize:
+            memoizer = Memoizer()
+            statements = memoizer.memoize(statements)
+            summary += memoizer.summary()
+            # The hidden locals take slots of their own.
+            Resolver().resolve(statements)
+        if self.report:
+            for line in summary:
+                print(line, file=sys.stderr)
+        return statements
+
+    def runFile(self, filePath, stream=False, mapped=False):
+        # The script is the whole program.
+        self.keepGlobals = False
+        if mapped:
+            self.runMapped(filePath, stream)
+        else:
+            with open(filePath) as f:
+                if stream:
+                    # Tokens are scanned from the file a line at a time as the
+                    # parser asks for them, none are held on to.
+                    self.runParser(StreamingParser(streamTokens(f)))
+                else:
+                    read_data = f.read()
+                    self.run(read_data)
+        if Error.hadError:
+            sys.exit(65)
+        if Error.hadRuntimeError:
+            sys.exit(70)
+
+    def runMapped(self, filePath, stream):
+        with open(filePath, "rb") as f, mapFile(f) as source:
+            tokens = scanBytes(source)
+            if stream:
+                self.runParser(StreamingParser(tokens))
+            else:
+                self.runParser(Parser(list(tokens)))
 
     def runPrompt(self):
         while True:
@@ -56,5 +197,16 @@ class Lox:
             Error.hadError = False
 
 
+def main(argv):
+    if sys.version_info[0] < 3:
+        raise Exception("Python 3 or a more recent version is required.")
+    args = parseArgs(argv)
+    lox = Lox(args.engine, args.scanner, args.optimize, args.report_removed)
+    if args.script is not None:
+        lox.runFile(args.script, args.stream, args.mmap)
+    else:
+        lox.runPrompt()
+
+
 if __name__ == "__main__":
-    lox = Lox()
+    main(sys.argv[1:])
@@ -0,0 +1,666 @@
+import re
+import traceback
+from functools import partial
+
+from token_type import TokenType
+from error import Error
+from custom_runtime_error import CustomRuntimeError
+from lox_callable import LoxCallable, Clock
+from lox_class import LoxClass
+from lox_instance import LoxInstance
+from expression import Assign, Binary, Grouping, Literal, Unary, Variable
+
+# Alternative execution engine that translates a resolved program into Python
+# source, compiles it with compile() and lets CPython run it.
+#
+# Lox functions become Python functions wrapped in PyFunction. Globals are
+# Python globals prefixed with `g_`, locals are Python locals named
+# `l<n>_<name>`. Locals captured by a closure are boxed in one element lists
+# that nested functions receive as keyword only default arguments, so every
+# execution of a declaration (e.g. once per loop iteration) gets a fresh
+# variable, as with the tree-walker's environments.
+#
+# Runtime type errors are raised with the token of the offending node, which
+# is looked up in the `_T` token table. Reads of undefined globals surface as
+# NameErrors that are mapped back to the Lox token by generated line.
+
+COMPARISON_OPERATORS = {
+    TokenType.GREATER: ">",
+    TokenType.GREATER_EQUAL: ">=",
+    TokenType.LESS: "<",
+    TokenType.LESS_EQUAL: "<=",
+}
+
+ARITHMETIC_OPERATORS = {
+    TokenType.MINUS: "-",
+    TokenType.SLASH: "/",
+    TokenType.STAR: "*",
+}
+
+EQUALITY_OPERATORS = {
+    TokenType.EQUAL_EQUAL: "==",
+    TokenType.BANG_EQUAL: "!=",
+}
+
+UNDEFINED_NAME = re.compile(r"name 'g_(\w+)' is not defined")
+
+
+def ungrouped(expr):
+    while isinstance(expr, Grouping):
+        expr = expr.expression
+    return expr
+
+
+class PyFunction(LoxCallable):
+    __slots__ = ("name", "fn", "paramCount", "isInitializer")
+
+    def __init__(self, name, fn, paramCount, isInitializer):
+        self.name = name
+        self.fn = fn
+        self.paramCount = paramCount
+        self.isInitializer = isInitializer
+
+    def call(self, interpreter, arguments):
+        return self.fn(*arguments)
+
+    def bind(self, instance):
+        return PyFunction(
+            self.name, partial(self.fn, instance), self.paramCount, self.isInitializer
+        )
+
+    def arity(self):
+        return self.paramCount
+
+    def __str__(self):
+        return f"<fn {self.name}>"
+
+
+# Stands in for the callee when the fast path for calling a PyFunction does
+# not apply. Arguments are evaluated before it runs the checks, in the same
+# order as the tree-walker's visitCallExpr.
+class SlowCall:
+    def __init__(self, callee, paren):
+        self.callee = callee
+        self.paren = paren
+
+    def fn(self, *arguments):
+        callee = self.callee
+        if not isinstance(callee, LoxCallable):
+            raise CustomRuntimeError(self.paren, "Can only call functions and classes.")
+        if len(arguments) != callee.arity():
+            raise CustomRuntimeError(
+                self.paren,
+                f"Expected {callee.arity()} arguments but got {len(arguments)}.",
+            )
+        return callee.call(None, list(arguments))
+
+
+def runtimeError(token, message):
+    raise CustomRuntimeError(token, message)
+
+
+def getGlobal(namespace, name, token):
+    if name not in namespace:
+        raise CustomRuntimeError(token, f"Undefined variable '{token.lexeme}'.")
+    return namespace[name]
+
+
+def setGlobal(namespace, name, value, token):
+    if name not in namespace:
+        raise CustomRuntimeError(token, f"Undefined variable '{token.lexeme}.'")
+    namespace[name] = value
+    return value
+
+
+def setCell(cell, value):
+    cell[0] = value
+    return value
+
+
+def getProperty(obj, name):
+    if isinstance(obj, LoxInstance):
+        return obj.get(name)
+    raise CustomRuntimeError(name, "Only instances have properties.")
+
+
+def instanceForSet(obj, name):
+    if isinstance(obj, LoxInstance):
+        return obj
+    raise CustomRuntimeError(name, "Only instances have fields.")
+
+
+def setProperty(instance, name, value):
+    instance.set(name, value)
+    return value
+
+
+def checkSuperclass(superclass, name):
+    if isinstance(superclass, LoxClass):
+        return superclass
+    raise CustomRuntimeError(name, "Superclass must be a class.")
+
+
+def superMethod(superclass, instance, method):
+    function = superclass.findMethod(method.lexeme)
+    if function is None:
+        raise CustomRuntimeError(method, f"Undefined property '{method.lexeme}'.")
+    return function.bind(instance)
+
+
+RUNTIME = {
+    "_Function": PyFunction,
+    "_SlowCall": SlowCall,
+    "_LoxClass": LoxClass,
+    "_NUMBER_OR_STRING": (float, str),
+    "_error": runtimeError,
+    "_setCell": setCell,
+    "_getProperty": getProperty,
+    "_instanceForSet": instanceForSet,
+    "_setProperty": setProperty,
+    "_checkSuperclass": checkSuperclass,
+    "_superMethod": superMethod,
+}
+
+
+class Binding:
+    def __init__(self, pyName, level, declaration, isCell):
+        self.pyName = pyName
+        self.level = level
+        self.declaration = declaration
+        self.isCell = isCell
+
+    def read(self):
+        if self.isCell:
+            return f"{self.pyName}[0]"
+        return self.pyName
+
+
+class Frame:
+    def __init__(self, isInitializer=False):
+        self.isInitializer = isInitializer
+        # Names of enclosing locals this Python function has to receive as
+        # default arguments, in first use order.
+        self.freeNames = {}
+
+
+# Generates the Python source for one program. Run it once to find which
+# declarations are captured by closures and again with that set to produce
+# the final code.
+class PythonGenerator:
+    def __init__(self, unit, tokenBase, captured):
+        self.unit = unit
+        self.tokenBase = tokenBase
+        self.captured = captured
+        self.foundCaptured = set()
+        self.tokens = []
+        self.lines = []
+        self.indent = 0
+        self.counter = 0
+        self.scopes = []
+        self.frames = [Frame()]
+        self.globalNames = {}
+        self.pendingReads = []
+        self.globalReads = {}
+
+    def generate(self, statements):
+        self.emit("def __lox_main__():")
+        self.indent += 1
+        globalsLine = len(self.lines)
+        self.emit("pass")
+        for statement in statements:
+            statement.accept(self)
+        if self.globalNames:
+            self.lines[globalsLine] = "    global " + ", ".join(self.globalNames)
+        return "\n".join(self.lines) + "\n"
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+        for name, token in self.pendingReads:
+            self.globalReads.setdefault((len(self.lines), name), token)
+        self.pendingReads = []
+
+    def suite(self, statements):
+        self.indent += 1
+        start = len(self.lines)
+        for statement in statements:
+            statement.accept(self)
+        if len(self.lines) == start:
+            self.emit("pass")
+        self.indent -= 1
+
+    def uniqueName(self, prefix, name):
+        self.counter += 1
+        return f"{prefix}{self.counter}_{name}"
+
+    def temp(self):
+        self.counter += 1
+        return f"_t{self.counter}"
+
+    def token(self, token):
+        self.tokens.append(token)
+        return f"_T[{self.tokenBase + len(self.tokens) - 1}]"
+
+    def error(self, token, message):
+        return f"_error({self.token(token)}, {message!r})"
+
+    def beginScope(self):
+        self.scopes.append({})
+
+    def endScope(self):
+        self.scopes.pop()
+
+    def declare(self, name):
+        if not self.scopes:
+            pyName = f"g_{name.lexeme}"
+            self.globalNames[pyName] = None
+            return Binding(pyName, 0, name, False)
+        binding = Binding(
+            self.uniqueName("l", name.lexeme),
+            len(self.frames) - 1,
+            name,
+            name in self.captured,
+        )
+        self.scopes[-1][name.lexeme] = binding
+        return binding
+
+    def lookup(self, expr, name):
+        if expr.depth is None:
+            return None
+        return self.use(self.innermost(name.lexeme))
+
+    def innermost(self, name):
+        # The Resolver's depth counts runtime environments, not these scopes,
+        # the same name is found by searching outwards instead.
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+
+    def use(self, binding):
+        # Bindings of enclosing functions are captured, every function in
+        # between has to pass them on as default arguments.
+        if binding.level < len(self.frames) - 1:
+            self.foundCaptured.add(binding.declaration)
+            for frame in self.frames[binding.level + 1 :]:
+                frame.freeNames[binding.pyName] = None
+        return binding
+
+    def read(self, expr, name):
+        binding = self.lookup(expr, name)
+        if binding is None:
+            # A NameError is mapped back to the first read of the name on its
+            # line, later reads from other Lox lines check for themselves.
+            for pendingName, token in self.pendingReads:
+                if pendingName == name.lexeme and token.line != name.line:
+                    return f"_getGlobal('g_{name.lexeme}', {self.token(name)})"
+            self.pendingReads.append((name.lexeme, name))
+            return f"g_{name.lexeme}"
+        return binding.read()
+
+    def operand(self, expr):
+        # Returns the code evaluating `expr` the first time, the code reading
+        # the value again afterwards and the value's type if it is known.
+        expr = ungrouped(expr)
+        if isinstance(expr, Literal):
+            return repr(expr.value), repr(expr.value), type(expr.value)
+        code = expr.accept(self)
+        temp = self.temp()
+        return f"({temp} := {code})", temp, None
+
+    def isSimple(self, expr):
+        expr = ungrouped(expr)
+        if isinstance(expr, Literal):
+            return True
+        if isinstance(expr, Variable):
+            binding = self.lookup(expr, expr.name)
+            return binding is not None and not binding.isCell
+        return False
+
+    def isBoolean(self, expr):
+        expr = ungrouped(expr)
+        if isinstance(expr, Literal):
+            return isinstance(expr.value, bool)
+        if isinstance(expr, Unary):
+            return expr.operator.type == TokenType.BANG
+        if isinstance(expr, Binary):
+            return (
+                expr.operator.type in COMPARISON_OPERATORS
+                or expr.operator.type in EQUALITY_OPERATORS
+            )
+        return False
+
+    def truthy(self, expr):
+        code = expr.accept(self)
+        if self.isBoolean(expr):
+            return code
+        temp = self.temp()
+        return f"(({temp} := {code}) is not None and {temp} is not False)"
+
+    def binaryOperands(self, expr):
+        # Locals can be read directly, without a temporary, only when the
+        # other operand cannot assign to them in between.
+        if self.isSimple(expr.left) and self.isSimple(expr.right):
+            left = expr.left.accept(self)
+            right = expr.right.accept(self)
+            return (
+                (left, left, self.literalType(expr.left)),
+                (right, right, self.literalType(expr.right)),
+            )
+        return self.operand(expr.left), self.operand(expr.right)
+
+    def literalType(self, expr):
+        expr = ungrouped(expr)
+        if isinstance(expr, Literal):
+            return type(expr.value)
+        return None
+
+    def typeCheck(self, left, right, allowed):
+        (leftFirst, _, leftType), (rightFirst, _, rightType) = left, right
+        if leftType is not None and rightType is not None:
+            if leftType is rightType and leftType in allowed:
+                return None
+            return "False"
+        if leftType in allowed:
+            return f"type({rightFirst}) is {leftType.__name__}"
+        if rightType in allowed:
+            return f"type({leftFirst}) is {rightType.__name__}"
+        if len(allowed) == 1:
+            return f"type({leftFirst}) is type({rightFirst}) is float"
+        return f"type({leftFirst}) is type({rightFirst}) in _NUMBER_OR_STRING"
+
+    def visitLiteralExpr(self, expr):
+        return repr(expr.value)
+
+    def visitGroupingExpr(self, expr):
+        return expr.expression.accept(self)
+
+    def visitUnaryExpr(self, expr):
+        if expr.operator.type == TokenType.BANG:
+            right = ungrouped(expr.right)
+            if isinstance(right, Literal):
+                # Comparing a literal with `is` makes compile() warn.
+                return repr(right.value is None or right.value is False)
+            first, value, _ = self.operand(right)
+            return f"({first} is None or {value} is False)"
+
+        if self.isSimple(expr.right):
+            first = value = expr.right.accept(self)
+        else:
+            first, value, _ = self.operand(expr.right)
+        error = self.error(expr.operator, "Operand must be a number")
+        return f"(-{value} if type({first}) is float else {error})"
+
+    def visitBinaryExpr(self, expr):
+        operator_type = expr.operator.type
+        if operator_type in EQUALITY_OPERATORS:
+            left = expr.left.accept(self)
+            right = expr.right.accept(self)
+            return f"({left} {EQUALITY_OPERATORS[operator_type]} {right})"
+
+        left, right = self.binaryOperands(expr)
+        if operator_type == TokenType.PLUS:
+            operator = "+"
+            check = self.typeCheck(left, right, (float, str))
+            message = "Operands must be two numbers or two strings."
+        else:
+            if operator_type in COMPARISON_OPERATORS:
+                operator = COMPARISON_OPERATORS[operator_type]
+            else:
+                operator = ARITHMETIC_OPERATORS[operator_type]
+            check = self.typeCheck(left, right, (float,))
+            message = "Operands must be numbers."
+
+        if check is None:
+            return f"({left[0]} {operator} {right[0]})"
+        if check == "False":
+            return f"({left[0]}, {right[0]}, {self.error(expr.operator, message)})"
+        return (
+            f"({left[1]} {operator} {right[1]} if {check} "
+            f"else {self.error(expr.operator, message)})"
+        )
+
+    def visitLogicalExpr(self, expr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if self.isBoolean(expr.left):
+            keyword = "or" if expr.operator.type == TokenType.OR else "and"
+            return f"({left} {keyword} {right})"
+
+        temp = self.temp()
+        truthy = f"({temp} := {left}) is not None and {temp} is not False"
+        if expr.operator.type == TokenType.OR:
+            return f"({temp} if {truthy} else {right})"
+        return f"({right} if {truthy} else {temp})"
+
+    def visitVariableExpr(self, expr):
+        return self.read(expr, expr.name)
+
+    def visitAssignExpr(self, expr):
+        value = expr.value.accept(self)
+        binding = self.lookup(expr, expr.name)
+        if binding is None:
+            return (
+                f"_setGlobal('g_{expr.name.lexeme}', {value}, "
+                f"{self.token(expr.name)})"
+            )
+        if binding.isCell:
+            return f"_setCell({binding.pyName}, {value})"
+        return f"({binding.pyName} := {value})"
+
+    def visitInlineExpr(self, expr):
+        # Compiled as the call it stands for, PyFunctions don't keep the
+        # declaration an inlined call has to check the callee against.
+        return expr.call.accept(self)
+
+    def visitCallExpr(self, expr):
+        callee = expr.callee.accept(self)
+        arguments = ", ".join(argument.accept(self) for argument in expr.arguments)
+        temp = self.temp()
+        paren = self.token(expr.paren)
+        return (
+            f"({temp} if type({temp} := {callee}) is _Function and "
+            f"{temp}.paramCount == {len(expr.arguments)} "
+            f"else _SlowCall({temp}, {paren})).fn({arguments})"
+        )
+
+    def visitGetExpr(self, expr):
+        obj = expr.object.accept(self)
+        return f"_getProperty({obj}, {self.token(expr.name)})"
+
+    def visitSetExpr(self, expr):
+        obj = expr.object.accept(self)
+        value = expr.value.accept(self)
+        name = self.token(expr.name)
+        return f"_setProperty(_instanceForSet({obj}, {name}), {name}, {value})"
+
+    def visitThisExpr(self, expr):
+        return self.read(expr, expr.keyword)
+
+    def visitSuperExpr(self, expr):
+        superclass = self.lookup(expr, expr.keyword)
+        instance = self.use(self.innermost("this"))
+        return (
+            f"_superMethod({superclass.read()}, {instance.read()}, "
+            f"{self.token(expr.method)})"
+        )
+
+    def visitExpressionStmt(self, stmt):
+        expr = stmt.expression
+        if isinstance(expr, Assign):
+            binding = self.lookup(expr, expr.name)
+            if binding is not None:
+                self.emit(f"{binding.read()} = {expr.value.accept(self)}")
+                return
+        self.emit(expr.accept(self))
+
+    def visitPrintStmt(self, stmt):
+        self.emit(f"print(str({stmt.expression.accept(self)}))")
+
+    def visitVarStmt(self, stmt):
+        value = "None"
+        if stmt.initializer is not None:
+            value = stmt.initializer.accept(self)
+        binding = self.declare(stmt.name)
+        self.defineBinding(binding, value)
+
+    def defineBinding(self, binding, value):
+        if binding.isCell:
+            self.emit(f"{binding.pyName} = [{value}]")
+        else:
+            self.emit(f"{binding.pyName} = {value}")
+
+    def visitBlockStmt(self, stmt):
+        self.beginScope()
+        for statement in stmt.statements:
+            statement.accept(self)
+        self.endScope()
+
+    def visitIfStmt(self, stmt):
+        self.emit(f"if {self.truthy(stmt.condition)}:")
+        self.suite([stmt.thenBranch])
+        if stmt.elseBranch is not None:
+            self.emit("else:")
+            self.suite([stmt.elseBranch])
+
+    def visitWhileStmt(self, stmt):
+        self.emit(f"while {self.truthy(stmt.condition)}:")
+        self.suite([stmt.body])
+
+    def visitReturnStmt(self, stmt):
+        if self.frames[-1].isInitializer:
+            self.emit("return this_")
+        elif stmt.value is None:
+            self.emit("return None")
+        else:
+            self.emit(f"return {stmt.value.accept(self)}")
+
+    def visitFunctionStmt(self, stmt):
+        binding = self.declare(stmt.name)
+        if binding.isCell:
+            self.emit(f"{binding.pyName} = [None]")
+        fn = self.function(stmt, False, False)
+        value = f"_Function({stmt.name.lexeme!r}, {fn}, {len(stmt.params)}, False)"
+        self.emit(f"{binding.read()} = {value}")
+
+    def function(self, declaration, isMethod, isInitializer):
+        fn = self.uniqueName("f", declaration.name.lexeme)
+        headerLine = len(self.lines)
+        self.emit("")
+
+        frame = Frame(isInitializer)
+        self.frames.append(frame)
+        self.beginScope()
+        self.indent += 1
+        params = ["this_"] if isMethod else []
+        for param in declaration.params:
+            binding = self.declare(param)
+            params.append(binding.pyName)
+            if binding.isCell:
+                self.emit(f"{binding.pyName} = [{binding.pyName}]")
+        for statement in declaration.body:
+            statement.accept(self)
+        if isInitializer:
+            self.emit("return this_")
+        elif len(self.lines) == headerLine + 1:
+            self.emit("pass")
+        self.indent -= 1
+        self.endScope()
+        self.frames.pop()
+
+        if frame.freeNames:
+            params.append("*")
+            params.extend(f"{name}={name}" for name in frame.freeNames)
+        self.lines[headerLine] = (
+            "    " * self.indent + f"def {fn}({', '.join(params)}):"
+        )
+        return fn
+
+    def visitClassStmt(self, stmt):
+        superclass = "None"
+        if stmt.superclass is not None:
+            # On a line of its own, so an undefined superclass is reported
+            # against the line reading it.
+            superclass = self.temp()
+            self.emit(f"{superclass} = {self.checkedSuperclass(stmt)}")
+
+        binding = self.declare(stmt.name)
+        self.defineBinding(binding, "None")
+
+        if stmt.superclass is not None:
+            self.beginScope()
+            superBinding = Binding(
+                self.uniqueName("l", "super"), len(self.frames) - 1, None, False
+            )
+            self.scopes[-1]["super"] = superBinding
+            self.emit(f"{superBinding.pyName} = {superclass}")
+            superclass = superBinding.pyName
+
+        self.beginScope()
+        self.scopes[-1]["this"] = Binding("this_", len(self.frames), None, False)
+        methods = []
+        for method in stmt.methods:
+            isInitializer = method.name.lexeme == "init"
+            fn = self.function(method, True, isInitializer)
+            methods.append(
+                f"{method.name.lexeme!r}: _Function({method.name.lexeme!r}, {fn}, "
+                f"{len(method.params)}, {isInitializer})"
+            )
+        self.endScope()
+        if stmt.superclass is not None:
+            self.endScope()
+
+        klass = (
+            f"_LoxClass({stmt.name.lexeme!r}, {superclass}, "
+            f"{{{', '.join(methods)}}})"
+        )
+        self.emit(f"{binding.read()} = {klass}")
+
+    def checkedSuperclass(self, stmt):
+        superclass = stmt.superclass.accept(self)
+        return f"_checkSuperclass({superclass}, {self.token(stmt.superclass.name)})"
+
+
+class PythonCompiler:
+    def __init__(self):
+        self.units = 0
+        self.tokens = []
+        self.globalReads = {}
+        self.namespace = dict(RUNTIME)
+        self.namespace["_T"] = self.tokens
+        self.namespace["_getGlobal"] = partial(getGlobal, self.namespace)
+        self.namespace["_setGlobal"] = partial(setGlobal, self.namespace)
+        self.namespace["g_clock"] = Clock()
+
+    def interpret(self, statements):
+        self.units += 1
+        unit = f"<lox {self.units}>"
+        generator = PythonGenerator(unit, len(self.tokens), set())
+        generator.generate(statements)
+        generator = PythonGenerator(unit, len(self.tokens), generator.foundCaptured)
+        source = generator.generate(statements)
+
+        self.tokens.extend(generator.tokens)
+        for (line, name), token in generator.globalReads.items():
+            self.globalReads[(unit, line, name)] = token
+        exec(compile(source, unit, "exec"), self.namespace)
+
+        try:
+            self.namespace["__lox_main__"]()
+        except CustomRuntimeError as err:
+            Error.runtimeError(err)
+        except NameError as err:
+            Error.runtimeError(self.undefinedVariable(err))
+
+    def undefinedVariable(self, err):
+        match = UNDEFINED_NAME.match(str(err))
+        frames = [
+            frame
+            for frame in traceback.extract_tb(err.__traceback__)
+            if frame.filename.startswith("<lox ")
+        ]
+        if match is None or not frames:
+            raise err
+        key = (frames[-1].filename, frames[-1].lineno, match.group(1))
+        if key not in self.globalReads:
+            raise err
+        name = self.globalReads[key]
+        return CustomRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
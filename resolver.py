@@ -1,6 +1,7 @@
 from enum import Enum, auto
 
-from stmt import Stmt
+from expression import Variable
+from stmt import Stmt, Block, Class, Function, If, Var, While
 from error import Error
 
 
@@ -17,22 +18,114 @@ class ClassType(Enum):
     SUBCLASS = auto()
 
 
+# A local scope. `defined` is False for a name while its initializer is being
+# resolved, `slots` gives each name its index in the runtime environment.
+# `frame` is the scope that owns that environment, itself unless the scope is
+# an elided block, whose locals take the next free slots of the frame.
+#
+# Names in `captured` are used by functions nested in the one owning the
+# scope. They live in cells, which their declaration and every local
+# `references` to them are marked for once the scope ends. Declarations whose
+# name isn't in `used` by then are never referenced.
+class Scope:
+    def __init__(self, function, frame=None):
+        self.function = function
+        self.defined = {}
+        self.slots = {}
+        self.frame = self if frame is None else frame
+        self.size = 0
+        self.declarations = {}
+        self.references = {}
+        self.captured = set()
+        self.used = set()
+
+    def add(self, name, defined):
+        self.defined[name] = defined
+        if name not in self.slots:
+            self.slots[name] = self.frame.size
+            self.frame.size += 1
+
+
+# The function being resolved, the top-level script included. `scopeCount`
+# is the number of scopes around its declaration, `upvalues` lists what each
+# of its upvalues captures when the function is created: (depth, slot) of a
+# local of the enclosing function, or (None, index) of one of its upvalues.
+class FunctionContext:
+    def __init__(self, enclosing, scopeCount):
+        self.enclosing = enclosing
+        self.scopeCount = scopeCount
+        self.upvalues = []
+        self.upvalueIndexes = {}
+
+
+def declaresCallable(stmt):
+    if isinstance(stmt, (Function, Class)):
+        return True
+    if isinstance(stmt, Block):
+        return any(declaresCallable(statement) for statement in stmt.statements)
+    if isinstance(stmt, If):
+        return declaresCallable(stmt.thenBranch) or (
+            stmt.elseBranch is not None and declaresCallable(stmt.elseBranch)
+        )
+    if isinstance(stmt, While):
+        return declaresCallable(stmt.body)
+    return False
+
+
+# Resolving a program again, after the Optimizer rewrote it, replaces the
+# annotations left by the previous pass.
 class Resolver:
-    def __init__(self, interpreter):
-        self.interpreter = interpreter
+    def __init__(self):
         self.scopes = []
+        self.function = FunctionContext(None, 0)
         self.currentFunction = FunctionType.NONE
         self.currentClass = ClassType.NONE
+        # Usage tracking: local declarations that are never referenced, how
+        # many times each global is referenced and how many of those call it
+        # or assign it, and the declarations at the top level.
+        self.unused = set()
+        self.globalUses = {}
+        self.globalCalls = {}
+        self.globalAssignments = {}
+        self.globalDeclarations = []
+
+    def unusedGlobals(self):
+        return [
+            declaration
+            for declaration in self.globalDeclarations
+            if declaration.name.lexeme not in self.globalUses
+        ]
 
     def visitBlockStmt(self, stmt):
-        self.beginScope()
+        stmt.needsEnvironment = not self.canElide(stmt)
+        if not stmt.needsEnvironment:
+            self.beginScope(self.scopes[-1].frame)
+        else:
+            self.beginScope()
         self.resolve(stmt.statements)
         self.endScope()
 
+    def canElide(self, block):
+        # Nothing declared inside can capture the block's locals, and none of
+        # them shadows a name of the frame, so backends keeping locals by name
+        # can share the frame too.
+        if len(self.scopes) == 0 or declaresCallable(block):
+            return False
+        frame = self.scopes[-1].frame
+        visible = set()
+        for scope in reversed(self.scopes):
+            if scope.frame is not frame:
+                break
+            visible.update(scope.slots)
+        return not any(
+            isinstance(statement, Var) and statement.name.lexeme in visible
+            for statement in block.statements
+        )
+
     def visitClassStmt(self, stmt):
         enclosingClass = self.currentClass
         self.currentClass = ClassType.CLASS
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         self.define(stmt.name)
 
         if (
@@ -49,18 +142,14 @@ class Resolver:
 
         if stmt.superclass is not None:
             self.beginScope()
-            self.scopes[-1]["super"] = True
-
-        self.beginScope()
-        self.scopes[-1]["this"] = True
+            self.scopes[-1].add("super", True)
 
         for method in stmt.methods:
             declaration = FunctionType.METHOD
             if method.name.lexeme == "init":
                 declaration = FunctionType.INITIALIZER
-            self.resolveFunction(method, FunctionType.METHOD)
+            self.resolveFunction(method, declaration)
 
-        self.endScope()
         if stmt.superclass is not None:
             self.endScope()
         self.currentClass = enclosingClass
@@ -82,38 +171,77 @@ class Resolver:
             expr.accept(self)
 
     def visitVarStmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         if stmt.initializer is not None:
             self.resolve(stmt.initializer)
         self.define(stmt.name)
 
     def visitFunctionStmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         self.define(stmt.name)
 
         self.resolveFunction(stmt, FunctionType.FUNCTION)
 
     def visitVariableExpr(self, expr):
-        if len(self.scopes) != 0 and (self.scopes[-1].get(expr.name.lexeme) == False):
+        if len(self.scopes) != 0 and (
+            self.scopes[-1].defined.get(expr.name.lexeme) == False
+        ):
             Error.tokenError(
                 expr.name, "Can't read local variable in its  own initializer"
             )
 
-        self.resolveLocal(expr, expr.name)
+        self.resolveLocal(expr, expr.name.lexeme)
 
     def visitAssignExpr(self, expr):
         self.resolve(expr.value)
-        self.resolveLocal(expr, expr.name)
+        self.resolveLocal(expr, expr.name.lexeme)
+        if expr.depth is None:
+            name = expr.name.lexeme
+            self.globalAssignments[name] = self.globalAssignments.get(name, 0) + 1
 
     def visitBinaryExpr(self, expr):
         self.resolve(expr.left)
         self.resolve(expr.right)
 
     def resolveLocal(self, expr, name):
+        expr.depth = None
+        expr.slot = None
+        expr.upvalue = None
+        expr.isCell = False
+        # Depth counts runtime environments, elided blocks don't have one.
+        depth = 0
         for i in reversed(range(len(self.scopes))):
-            if name.lexeme in self.scopes[i]:
-                self.interpreter.resolve(expr, len(self.scopes) - 1 - i)
-                return
+            scope = self.scopes[i]
+            slot = scope.slots.get(name)
+            if slot is None:
+                if scope.frame is scope:
+                    depth += 1
+                continue
+            expr.depth = depth
+            scope.used.add(name)
+            if scope.function is self.function:
+                expr.slot = slot
+                scope.references.setdefault(name, []).append(expr)
+            else:
+                scope.captured.add(name)
+                expr.upvalue = self.captureUpvalue(self.function, i, slot)
+            return
+        self.globalUses[name] = self.globalUses.get(name, 0) + 1
+
+    def captureUpvalue(self, function, index, slot):
+        if self.scopes[index].function is function.enclosing:
+            depth = 0
+            for scope in self.scopes[index + 1 : function.scopeCount]:
+                if scope.frame is scope:
+                    depth += 1
+            upvalue = (depth, slot)
+        else:
+            upvalue = (None, self.captureUpvalue(function.enclosing, index, slot))
+
+        if upvalue not in function.upvalueIndexes:
+            function.upvalueIndexes[upvalue] = len(function.upvalues)
+            function.upvalues.append(upvalue)
+        return function.upvalueIndexes[upvalue]
 
     def visitExpressionStmt(self, stmt):
         self.resolve(stmt.expression)
@@ -128,7 +256,7 @@ class Resolver:
         self.resolve(stmt.expression)
 
     def visitReturnStmt(self, stmt):
-        if self.currentFunction == TokenType.NONE:
+        if self.currentFunction == FunctionType.NONE:
             Error.tokenError(stmt.keyword, "Can't return from top-level code.")
 
         if stmt.value is not None:
@@ -144,9 +272,29 @@ class Resolver:
 
     def visitCallExpr(self, expr):
         self.resolve(expr.callee)
+        callee = expr.callee
+        if isinstance(callee, Variable) and callee.depth is None:
+            name = callee.name.lexeme
+            self.globalCalls[name] = self.globalCalls.get(name, 0) + 1
         for argument in expr.arguments:
             self.resolve(argument)
 
+    def visitInlineExpr(self, expr):
+        self.resolve(expr.call)
+        # The body belongs to a top-level function, what it names apart from
+        # the parameters are globals wherever it was inlined.
+        scopes = self.scopes
+        self.scopes = []
+        self.resolve(expr.body)
+        self.scopes = scopes
+
+    def visitParameterExpr(self, expr):
+        pass
+
+    def visitCachedExpr(self, expr):
+        self.resolve(expr.expression)
+        self.resolve(expr.variable)
+
     def visitGetExpr(self, expr):
         self.resolve(expr.object)
 
@@ -174,12 +322,13 @@ class Resolver:
                 expr.keyword, "Can't use 'super' in a class with no superclass."
             )
 
-        self.resolveLocal(expr, expr.keyword)
+        self.resolveLocal(expr, "super")
+        self.resolveLocal(expr.receiver, "this")
 
     def visitThisExpr(self, expr):
         if self.currentClass == ClassType.NONE:
             Error.tokenError(expr.keyword, "Can't use 'this' outside of a class.")
-        self.resolveLocal(expr, expr.keyword)
+        self.resolveLocal(expr, "this")
 
     def visitUnaryExpr(self, expr):
         self.resolve(expr.right)
@@ -187,30 +336,59 @@ class Resolver:
     def resolveFunction(self, function, functionType):
         enclosingFunction = self.currentFunction
         self.currentFunction = functionType
+        self.function = FunctionContext(self.function, len(self.scopes))
         self.beginScope()
+        # Methods get their receiver in slot 0, ahead of the parameters.
+        if functionType in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            self.scopes[-1].add("this", True)
         for param in function.params:
             self.declare(param)
             self.define(param)
         self.resolve(function.body)
+
+        scope = self.scopes[-1]
+        function.cellSlots = tuple(
+            scope.slots[name]
+            for name in scope.captured
+            if name not in scope.declarations
+        )
         self.endScope()
+        function.upvalues = tuple(self.function.upvalues)
+        self.function = self.function.enclosing
         self.currentFunction = enclosingFunction
 
     def define(self, name):
         if len(self.scopes) == 0:
             return
-        scope = self.scopes[-1]
-        scope[name.lexeme] = True
+        self.scopes[-1].add(name.lexeme, True)
 
-    def declare(self, name):
+    def declare(self, name, declaration=None):
+        if declaration is not None:
+            declaration.isCaptured = False
         if len(self.scopes) == 0:
+            if declaration is not None:
+                self.globalDeclarations.append(declaration)
             return
         scope = self.scopes[-1]
-        if name.lexeme in scope:
+        if name.lexeme in scope.slots:
             Error.tokenError(name, "Already a variable with this name in this scope.")
-        scope[name.lexeme] = False
+        scope.add(name.lexeme, False)
+        if declaration is not None:
+            scope.declarations[name.lexeme] = declaration
 
-    def beginScope(self):
-        self.scopes.append({})
+    def beginScope(self, frame=None):
+        self.scopes.append(Scope(self.function, frame))
 
     def endScope(self):
-        self.scopes.pop()
+        scope = self.scopes.pop()
+        for name in scope.captured:
+            for expr in scope.references.get(name, ()):
+                expr.isCell = True
+            declaration = scope.declarations.get(name)
+            if declaration is not None:
+                declaration.isCaptured = True
+        for name, declaration in scope.declarations.items():
+            if name not in scope.used:
+                self.unused.add(declaration)
+        if scope.frame is not scope:
+            scope.frame.size -= len(scope.slots)
@@ -1,3 +0,0 @@
-class Return(Exception):
-    def __init__(self, value):
-        self.value = value
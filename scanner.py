@@ -1,24 +1,68 @@
+import re
+import sys
+from array import array
+
 from token_2 import Token
-from token_type import TokenType
+from token_type import (
+    LEFT_PAREN,
+    RIGHT_PAREN,
+    LEFT_BRACE,
+    RIGHT_BRACE,
+    COMMA,
+    DOT,
+    MINUS,
+    PLUS,
+    SEMICOLON,
+    SLASH,
+    STAR,
+    BANG,
+    BANG_EQUAL,
+    EQUAL,
+    EQUAL_EQUAL,
+    GREATER,
+    GREATER_EQUAL,
+    LESS,
+    LESS_EQUAL,
+    IDENTIFIER,
+    STRING,
+    NUMBER,
+    AND,
+    CLASS,
+    ELSE,
+    FALSE,
+    FUN,
+    FOR,
+    IF,
+    NIL,
+    OR,
+    PRINT,
+    RETURN,
+    SUPER,
+    THIS,
+    TRUE,
+    VAR,
+    WHILE,
+    EOF,
+)
 from error import Error
 
 keywords = {
-    "and": TokenType.AND,
-    "class": TokenType.CLASS,
-    "else": TokenType.ELSE,
-    "false": TokenType.FALSE,
-    "for": TokenType.FOR,
-    "fun": TokenType.FUN,
-    "if": TokenType.IF,
-    "nil": TokenType.NIL,
-    "or": TokenType.OR,
-    "print": TokenType.PRINT,
-    "return": TokenType.RETURN,
-    "super": TokenType.SUPER,
-    "this": TokenType.THIS,
-    "true": TokenType.TRUE,
-    "var": TokenType.VAR,
-    "while": TokenType.WHILE,
+    "and": AND,
+    "class": CLASS,
+    "else": ELSE,
+    "false": FALSE,
+    "for": FOR,
+    "fun": FUN,
+    "if": IF,
+    "nil": NIL,
+    "or": OR,
+    "print": PRINT,
+    "return": RETURN,
+    "super": SUPER,
+    "this": THIS,
+    "true": TRUE,
+    "var": VAR,
+    "while": WHILE,
 }
 
 
@@ -34,48 +78,46 @@ class Scanner:
         while not self.isAtEnd():
             self.start = self.current
             self.scanToken()
-        self.tokens.append(Token(TokenType.EOF, "", None, self.line))
+        self.tokens.append(Token(EOF, "", None, self.line))
         return self.tokens
 
     def scanToken(self):
         c = self.advance()
         if c == "(":
-            self.addToken(TokenType.LEFT_PAREN)
+            self.addToken(LEFT_PAREN)
         elif c == ")":
-            self.addToken(TokenType.RIGHT_PAREN)
+            self.addToken(RIGHT_PAREN)
         elif c == "{":
-            self.addToken(TokenType.LEFT_BRACE)
+            self.addToken(LEFT_BRACE)
         elif c == "}":
-            self.addToken(TokenType.RIGHT_BRACE)
+            self.addToken(RIGHT_BRACE)
         elif c == ",":
-            self.addToken(TokenType.COMMA)
+            self.addToken(COMMA)
         elif c == ".":
-            self.addToken(TokenType.DOT)
+            self.addToken(DOT)
         elif c == "-":
-            self.addToken(TokenType.MINUS)
+            self.addToken(MINUS)
         elif c == "+":
-            self.addToken(TokenType.PLUS)
+            self.addToken(PLUS)
         elif c == ";":
-            self.addToken(TokenType.SEMICOLON)
+            self.addToken(SEMICOLON)
         elif c == "*":
-            self.addToken(TokenType.STAR)
+            self.addToken(STAR)
         elif c == "!":
-            self.addToken(TokenType.BANG_EQUAL if self.match("=") else TokenType.BANG)
+            self.addToken(BANG_EQUAL if self.match("=") else BANG)
         elif c == "=":
-            self.addToken(TokenType.EQUAL_EQUAL if self.match("=") else TokenType.EQUAL)
+            self.addToken(EQUAL_EQUAL if self.match("=") else EQUAL)
         elif c == "<":
-            self.addToken(TokenType.LESS_EQUAL if self.match("=") else TokenType.LESS)
+            self.addToken(LESS_EQUAL if self.match("=") else LESS)
         elif c == ">":
-            self.addToken(
-                TokenType.GREATER_EQUAL if self.match("=") else TokenType.GREATER
-            )
+            self.addToken(GREATER_EQUAL if self.match("=") else GREATER)
         elif c == "/":
             if self.match("/"):
                 while self.peek() != "\n" and not self.isAtEnd():
                     self.advance()
             else:
-                self.addToken(TokenType.SLASH)
-        elif any([c == x for x in [" ", "\r", "\t"]]):
+                self.addToken(SLASH)
+        elif c in " \r\t":
             pass
         elif c == "\n":
             self.line += 1
@@ -116,7 +158,7 @@ class Scanner:
             while self.isDigit(self.peek()):
                 self.advance()
 
-        self.addToken(TokenType.NUMBER, float(self.source[self.start : self.current]))
+        self.addToken(NUMBER, float(self.source[self.start : self.current]))
 
     def string(self):
         while self.peek() != '"' and not self.isAtEnd():
@@ -130,7 +172,7 @@ class Scanner:
 
         self.advance()
         value = self.source[self.start + 1 : self.current - 1]
-        self.addToken(TokenType.STRING, value)
+        self.addToken(STRING, value)
 
     def identifier(self):
         while self.isAlphaNumeric(self.peek()):
@@ -139,7 +181,7 @@ class Scanner:
         if text in keywords:
             tokenType = keywords[text]
         else:
-            tokenType = TokenType.IDENTIFIER
+            tokenType = IDENTIFIER
         self.addToken(tokenType)
 
     def isAlphaNumeric(self, c):
@@ -163,3 +205,232 @@ class Scanner:
 
     def isAtEnd(self):
         return self.current >= len(self.source)
+
+
+# Keywords and punctuation by lexeme, anything else the "word" group of
+# TOKEN_PATTERN matches is an identifier.
+WORDS = {
+    "(": LEFT_PAREN,
+    ")": RIGHT_PAREN,
+    "{": LEFT_BRACE,
+    "}": RIGHT_BRACE,
+    ",": COMMA,
+    ".": DOT,
+    "-": MINUS,
+    "+": PLUS,
+    ";": SEMICOLON,
+    "*": STAR,
+    "/": SLASH,
+    "!": BANG,
+    "!=": BANG_EQUAL,
+    "=": EQUAL,
+    "==": EQUAL_EQUAL,
+    "<": LESS,
+    "<=": LESS_EQUAL,
+    ">": GREATER,
+    ">=": GREATER_EQUAL,
+    **keywords,
+}
+
+# Alternatives are tried in order, so comments win over the slash and two
+# character operators over their first character. The character classes are
+# spelled out because the Scanner only knows ASCII letters and digits.
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<skip>(?:[ \r\t\n]|//[^\n]*)+)
+    |(?P<word>[A-Za-z_][A-Za-z_0-9]*|[!=<>]=?|[(){},.\-+;*/])
+    |(?P<number>[0-9]+(?:\.[0-9]+)?)
+    |(?P<string>"[^"]*")
+    |(?P<unterminated>"[^"]*)
+    |(?P<unexpected>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+# Produces the same tokens and errors as Scanner, a whole lexeme, or a run of
+# whitespace and comments, per match of TOKEN_PATTERN instead of a character
+# at a time.
+class RegexScanner:
+    def __init__(self, source):
+        self.source = source
+
+    def scanTokens(self):
+        return list(streamTokens((self.source,)))
+
+
+# Yields the tokens of a source read in chunks, the lines of a file for one.
+# Chunks have to end at a newline or the end of the source: only strings span
+# lines, an unfinished one is carried over. Its chunks are collected until one
+# holds the closing quote, so the string is scanned again only once.
+def streamTokens(chunks):
+    words = WORDS
+    line = 1
+    pending = []
+    for chunk in chunks:
+        if pending:
+            pending.append(chunk)
+            if '"' not in chunk:
+                continue
+            chunk = "".join(pending)
+            pending = []
+        for match in TOKEN_PATTERN.finditer(chunk):
+            kind = match.lastgroup
+            text = match.group()
+            if kind == "word":
+                yield Token(words.get(text, IDENTIFIER), text, None, line)
+            elif kind == "skip":
+                line += text.count("\n")
+            elif kind == "number":
+                yield Token(NUMBER, text, float(text), line)
+            elif kind == "string":
+                line += text.count("\n")
+                yield Token(STRING, text, text[1:-1], line)
+            elif kind == "unterminated":
+                pending.append(text)
+            else:
+                Error.error(line, "Unexpected character.")
+    if pending:
+        line += "".join(pending).count("\n")
+        Error.error(line, "Unterminated string.")
+    yield Token(EOF, "", None, line)
+
+
+# TOKEN_PATTERN for UTF-8 encoded sources, which are not read in text mode:
+# a lone "\r" ends lines too, and a non-ASCII character is a single
+# unexpected one however many bytes it takes.
+BYTES_TOKEN_PATTERN = re.compile(
+    rb"""
+    (?P<skip>(?:[ \r\t\n]|//[^\r\n]*)+)
+    |(?P<word>[A-Za-z_][A-Za-z_0-9]*|[!=<>]=?|[(){},.\-+;*/])
+    |(?P<number>[0-9]+(?:\.[0-9]+)?)
+    |(?P<string>"[^"]*")
+    |(?P<unterminated>"[^"]*)
+    |(?P<unexpected>[\xc0-\xff][\x80-\xbf]*|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+BYTES_WORDS = {word.encode(): (tokenType, word) for word, tokenType in WORDS.items()}
+
+
+# A "\r\n" is a single line end, as in text mode.
+def countLines(text):
+    if b"\r" in text:
+        return text.count(b"\n") + text.count(b"\r") - text.count(b"\r\n")
+    return text.count(b"\n")
+
+
+def decodeText(text):
+    text = text.decode()
+    if "\r" in text:
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+# Yields the tokens of a UTF-8 encoded source held as bytes, a memory-mapped
+# file for one, the same as RegexScanner gives for its decoded text. Only
+# lexemes are decoded: keywords and punctuation come from BYTES_WORDS, and
+# every distinct identifier is decoded the first time it is seen.
+def scanBytes(source):
+    words = dict(BYTES_WORDS)
+    line = 1
+    for match in BYTES_TOKEN_PATTERN.finditer(source):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "word":
+            word = words.get(text)
+            if word is None:
+                word = words[text] = (IDENTIFIER, text.decode())
+            yield Token(word[0], word[1], None, line)
+        elif kind == "skip":
+            line += countLines(text)
+        elif kind == "number":
+            yield Token(NUMBER, text.decode(), float(text), line)
+        elif kind == "string":
+            line += countLines(text)
+            lexeme = decodeText(text)
+            yield Token(STRING, lexeme, lexeme[1:-1], line)
+        elif kind == "unterminated":
+            line += countLines(text)
+            Error.error(line, "Unterminated string.")
+        else:
+            Error.error(line, "Unexpected character.")
+    yield Token(EOF, "", None, line)
+
+
+# Tokens as parallel arrays instead of Token objects: kinds as unsigned bytes
+# in an array, lexemes are the source between `starts` and `ends`. A Token is
+# only built when the parser needs one, to keep in the AST or to report an
+# error.
+class TokenBuffer:
+    __slots__ = ("source", "kinds", "starts", "ends", "lines")
+
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array("B")
+        self.starts = array("l")
+        self.ends = array("l")
+        self.lines = array("l")
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        return map(self.token, range(len(self.kinds)))
+
+    def token(self, index):
+        kind = self.kinds[index]
+        lexeme = self.source[self.starts[index] : self.ends[index]]
+        literal = None
+        if kind == IDENTIFIER:
+            # Names end up as environment and field keys.
+            lexeme = sys.intern(lexeme)
+        elif kind == NUMBER:
+            literal = float(lexeme)
+        elif kind == STRING:
+            literal = lexeme[1:-1]
+        return Token(kind, lexeme, literal, self.lines[index])
+
+
+# Scans with TOKEN_PATTERN like RegexScanner, into a TokenBuffer.
+class BufferScanner:
+    def __init__(self, source):
+        self.source = source
+
+    def scanTokens(self):
+        tokens = TokenBuffer(self.source)
+        addKind = tokens.kinds.append
+        addStart = tokens.starts.append
+        addEnd = tokens.ends.append
+        addLine = tokens.lines.append
+        words = WORDS
+        line = 1
+        for match in TOKEN_PATTERN.finditer(self.source):
+            kind = match.lastgroup
+            if kind == "word":
+                addKind(words.get(match.group(), IDENTIFIER))
+            elif kind == "skip":
+                line += match.group().count("\n")
+                continue
+            elif kind == "number":
+                addKind(NUMBER)
+            elif kind == "string":
+                line += match.group().count("\n")
+                addKind(STRING)
+            elif kind == "unterminated":
+                line += match.group().count("\n")
+                Error.error(line, "Unterminated string.")
+                continue
+            else:
+                Error.error(line, "Unexpected character.")
+                continue
+            start, end = match.span()
+            addStart(start)
+            addEnd(end)
+            addLine(line)
+        addKind(EOF)
+        addStart(len(self.source))
+        addEnd(len(self.source))
+        addLine(line)
+        return tokens
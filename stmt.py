@@ -1,9 +1,15 @@
+# Declarations, Var, Function and Class, have `isCaptured` set by the
+# Resolver when a closure captures the variable they declare.
 class Stmt:
+    __slots__ = ()
+
     def accept(self, visitor):
         raise NotImplementedError
 
 
 class Expression(Stmt):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -12,6 +18,8 @@ class Expression(Stmt):
 
 
 class Print(Stmt):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -20,23 +28,33 @@ class Print(Stmt):
 
 
 class Var(Stmt):
+    __slots__ = ("name", "initializer", "isCaptured")
+
     def __init__(self, name, initializer):
         self.name = name
         self.initializer = initializer
+        self.isCaptured = False
 
     def accept(self, visitor):
         return visitor.visitVarStmt(self)
 
 
 class Block(Stmt):
+    __slots__ = ("statements", "needsEnvironment")
+
     def __init__(self, statements):
         self.statements = statements
+        # Cleared by the Resolver when the block's locals can live in the
+        # enclosing environment instead of one of their own.
+        self.needsEnvironment = True
 
     def accept(self, visitor):
         return visitor.visitBlockStmt(self)
 
 
 class If(Stmt):
+    __slots__ = ("condition", "thenBranch", "elseBranch")
+
     def __init__(self, condition, thenBranch, elseBranch):
         self.condition = condition
         self.thenBranch = thenBranch
@@ -47,6 +65,8 @@ class If(Stmt):
 
 
 class While(Stmt):
+    __slots__ = ("condition", "body")
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
@@ -56,16 +76,25 @@ class While(Stmt):
 
 
 class Function(Stmt):
+    __slots__ = ("name", "params", "body", "isCaptured", "upvalues", "cellSlots")
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
         self.body = body
+        self.isCaptured = False
+        # Set by the Resolver, the (depth, slot) or (None, upvalue) each of
+        # its upvalues is captured from, and the parameter slots kept in cells.
+        self.upvalues = ()
+        self.cellSlots = ()
 
     def accept(self, visitor):
         return visitor.visitFunctionStmt(self)
 
 
 class Return(Stmt):
+    __slots__ = ("keyword", "value")
+
     def __init__(self, keyword, value):
         self.keyword = keyword
         self.value = value
@@ -75,10 +104,13 @@ class Return(Stmt):
 
 
 class Class(Stmt):
+    __slots__ = ("name", "superclass", "methods", "isCaptured")
+
     def __init__(self, name, superclass, methods):
         self.name = name
         self.superclass = superclass
         self.methods = methods
+        self.isCaptured = False
 
     def accept(self, visitor):
         return visitor.visitClassStmt(self)
@@ -0,0 +1,70 @@
+import contextlib
+import io
+import unittest
+
+from error import Error
+from lox_class import LoxClass
+from lox_instance import DICTIONARY, MAX_TRANSITIONS, LoxInstance
+from plox import Lox, ENGINES
+from scanner import Scanner, streamTokens
+
+
+def runAll(lox, *sources):
+    Error.hadError = False
+    Error.hadRuntimeError = False
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for source in sources:
+            lox.run(source)
+    return out.getvalue()
+
+
+class RunTest(unittest.TestCase):
+    def testLaterRunsSeeGlobals(self):
+        # Declarations the setup never uses itself are kept for later runs.
+        setup = "fun add(a, b) { return a + b; } var base = 10; class Point {}"
+        later = "print add(1, 2) + base; print Point;"
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output = runAll(Lox(engine), setup, later)
+                self.assertFalse(Error.hadRuntimeError)
+                self.assertEqual(output, "13.0\nPoint\n")
+
+
+class ShapeTest(unittest.TestCase):
+    def testClassesHaveTheirOwnTransitions(self):
+        # Each class only ever adds one field first, so none is megamorphic.
+        for i in range(MAX_TRANSITIONS + 8):
+            instance = LoxInstance(LoxClass(f"C{i}", None, {}))
+            instance.setField(f"field{i}", 1.0)
+            self.assertIsNot(instance.shape, DICTIONARY)
+            self.assertEqual(instance.field(f"field{i}"), 1.0)
+
+    def testSubclassesShareShapes(self):
+        base = LoxClass("Base", None, {})
+        derived = LoxClass("Derived", base, {})
+        instances = [LoxInstance(base), LoxInstance(derived)]
+        for instance in instances:
+            instance.setField("x", 1.0)
+        self.assertIs(instances[0].shape, instances[1].shape)
+
+
+class StreamTest(unittest.TestCase):
+    def testStringsSpanChunks(self):
+        source = 'var a = "one\n\ntwo\n";\nprint a + "three";\n'
+        streamed = streamTokens(io.StringIO(source))
+        expected = Scanner(source).scanTokens()
+        self.assertEqual(
+            [
+                (token.type, token.lexeme, token.literal, token.line)
+                for token in streamed
+            ],
+            [
+                (token.type, token.lexeme, token.literal, token.line)
+                for token in expected
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,12 @@
 # renamed the file from token.py to token_2.py
 # as token results in a conflict with some
 # other file named token.py in the python language
+from token_type import TokenType
+
+
 class Token:
+    __slots__ = ("type", "lexeme", "literal", "line")
+
     def __init__(self, tokenType, lexeme, literal, line):
         self.type = tokenType
         self.lexeme = lexeme
@@ -9,4 +14,4 @@ class Token:
         self.line = line
 
     def __str__(self):
-        return "{} {} {}".format(self.type, self.lexeme, self.literal)
+        return "{} {} {}".format(TokenType(self.type).name, self.lexeme, self.literal)
@@ -0,0 +1,478 @@
+from bytecode import (
+    CONSTANT,
+    NIL,
+    TRUE,
+    FALSE,
+    POP,
+    GET_LOCAL,
+    SET_LOCAL,
+    GET_GLOBAL,
+    DEFINE_GLOBAL,
+    SET_GLOBAL,
+    GET_UPVALUE,
+    SET_UPVALUE,
+    GET_PROPERTY,
+    SET_PROPERTY,
+    GET_SUPER,
+    EQUAL,
+    NOT_EQUAL,
+    GREATER,
+    GREATER_EQUAL,
+    LESS,
+    LESS_EQUAL,
+    ADD,
+    SUBTRACT,
+    MULTIPLY,
+    DIVIDE,
+    NOT,
+    NEGATE,
+    PRINT,
+    JUMP,
+    JUMP_IF_FALSE,
+    JUMP_IF_TRUE,
+    POP_JUMP_IF_FALSE,
+    LOOP,
+    CALL,
+    INVOKE,
+    SUPER_INVOKE,
+    CLOSURE,
+    CLOSE_UPVALUE,
+    RETURN,
+    CLASS,
+    INHERIT,
+)
+from bytecode_compiler import BytecodeCompiler
+from error import Error
+from custom_runtime_error import CustomRuntimeError
+from lox_callable import LoxCallable, Clock
+from lox_class import LoxClass
+from lox_instance import NO_FIELD, LoxInstance
+from interpreter import isEqual
+
+
+# A captured variable. While the variable is still on the VM stack `cells` is
+# the stack itself, once its scope ends the value moves into a one element
+# list of its own, so reads are `cells[index]` either way.
+class Upvalue:
+    __slots__ = ("cells", "index")
+
+    def __init__(self, cells, index):
+        self.cells = cells
+        self.index = index
+
+    def close(self):
+        self.cells = [self.cells[self.index]]
+        self.index = 0
+
+
+class VMClosure:
+    __slots__ = ("function", "upvalues")
+
+    def __init__(self, function, upvalues):
+        self.function = function
+        self.upvalues = upvalues
+
+    def bind(self, instance):
+        return BoundMethod(instance, self)
+
+    def arity(self):
+        return self.function.arity
+
+    def __str__(self):
+        return str(self.function)
+
+
+class BoundMethod:
+    __slots__ = ("receiver", "method")
+
+    def __init__(self, receiver, method):
+        self.receiver = receiver
+        self.method = method
+
+    def arity(self):
+        return self.method.arity()
+
+    def __str__(self):
+        return str(self.method)
+
+
+class VM:
+    def __init__(self):
+        self.globals = {"clock": Clock()}
+        self.stack = []
+        self.openUpvalues = {}
+
+    def interpret(self, statements):
+        function = BytecodeCompiler().compile(statements)
+        closure = VMClosure(function, [])
+        self.stack.append(closure)
+        try:
+            self.run(closure)
+        except CustomRuntimeError as err:
+            Error.runtimeError(err)
+            self.closeUpvalues(0)
+            del self.stack[:]
+
+    def captureUpvalue(self, slot):
+        upvalue = self.openUpvalues.get(slot)
+        if upvalue is None:
+            upvalue = Upvalue(self.stack, slot)
+            self.openUpvalues[slot] = upvalue
+        return upvalue
+
+    def closeUpvalues(self, lastSlot):
+        for slot in [slot for slot in self.openUpvalues if slot >= lastSlot]:
+            self.openUpvalues.pop(slot).close()
+
+    def callValue(self, callee, argCount, token):
+        # Returns the closure to run in a new frame whose slot zero is the
+        # callee's stack slot, or None when the call has already completed and
+        # its result replaced the callee and arguments on the stack.
+        stack = self.stack
+        if isinstance(callee, VMClosure):
+            self.checkArity(callee.function.arity, argCount, token)
+            return callee
+        if isinstance(callee, BoundMethod):
+            stack[-argCount - 1] = callee.receiver
+            self.checkArity(callee.method.function.arity, argCount, token)
+            return callee.method
+        if isinstance(callee, LoxClass):
+            stack[-argCount - 1] = LoxInstance(callee)
+            initializer = callee.initializer
+            if initializer is not None:
+                self.checkArity(initializer.function.arity, argCount, token)
+                return initializer
+            self.checkArity(0, argCount, token)
+            return None
+        if isinstance(callee, LoxCallable):
+            self.checkArity(callee.arity(), argCount, token)
+            arguments = stack[len(stack) - argCount :]
+            del stack[-argCount - 1 :]
+            stack.append(callee.call(self, arguments))
+            return None
+        raise CustomRuntimeError(token, "Can only call functions and classes.")
+
+    def checkArity(self, arity, argCount, token):
+        if argCount != arity:
+            raise CustomRuntimeError(
+                token, f"Expected {arity} arguments but got {argCount}."
+            )
+
+    def invoke(self, name, argCount, token):
+        receiver = self.stack[-argCount - 1]
+        if not isinstance(receiver, LoxInstance):
+            raise CustomRuntimeError(token, "Only instances have properties.")
+        callee = receiver.field(name)
+        if callee is not NO_FIELD:
+            self.stack[-argCount - 1] = callee
+            return self.callValue(callee, argCount, token)
+        return self.invokeFromClass(receiver.klass, name, argCount, token)
+
+    def invokeFromClass(self, klass, name, argCount, token):
+        method = klass.findMethod(name)
+        if method is None:
+            raise CustomRuntimeError(token, f"Undefined property '{name}'.")
+        self.checkArity(method.function.arity, argCount, token)
+        return method
+
+    def run(self, closure):
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        globals = self.globals
+        frames = []
+
+        chunk = closure.function.chunk
+        code = chunk.code
+        constants = chunk.constants
+        upvalues = closure.upvalues
+        base = len(stack) - 1
+        ip = 0
+
+        while True:
+            op = code[ip]
+            if op == GET_LOCAL:
+                push(stack[base + code[ip + 1]])
+                ip += 2
+            elif op == CONSTANT:
+                push(constants[code[ip + 1]])
+                ip += 2
+            elif op == GET_GLOBAL:
+                name = constants[code[ip + 1]]
+                if name not in globals:
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], f"Undefined variable '{name}'."
+                    )
+                push(globals[name])
+                ip += 2
+            elif op == SET_LOCAL:
+                stack[base + code[ip + 1]] = stack[-1]
+                ip += 2
+            elif op == POP_JUMP_IF_FALSE:
+                value = pop()
+                if value is None or value is False:
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+            elif op == POP:
+                pop()
+                ip += 1
+            elif op == ADD:
+                right = pop()
+                left = stack[-1]
+                if isinstance(left, float) and isinstance(right, float):
+                    stack[-1] = left + right
+                elif isinstance(left, str) and isinstance(right, str):
+                    stack[-1] = left + right
+                else:
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip],
+                        "Operands must be two numbers or two strings.",
+                    )
+                ip += 1
+            elif op == SUBTRACT:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, float) and isinstance(right, float)):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Operands must be numbers."
+                    )
+                stack[-1] = left - right
+                ip += 1
+            elif op == LESS:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, float) and isinstance(right, float)):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Operands must be numbers."
+                    )
+                stack[-1] = left < right
+                ip += 1
+            elif op == CALL:
+                argCount = code[ip + 1]
+                ip += 2
+                target = self.callValue(
+                    stack[-argCount - 1], argCount, chunk.tokens[ip - 2]
+                )
+                if target is not None:
+                    frames.append((closure, ip, base))
+                    closure = target
+                    chunk = closure.function.chunk
+                    code = chunk.code
+                    constants = chunk.constants
+                    upvalues = closure.upvalues
+                    base = len(stack) - argCount - 1
+                    ip = 0
+            elif op == RETURN:
+                result = pop()
+                if self.openUpvalues:
+                    self.closeUpvalues(base)
+                del stack[base:]
+                if not frames:
+                    return
+                push(result)
+                closure, ip, base = frames.pop()
+                chunk = closure.function.chunk
+                code = chunk.code
+                constants = chunk.constants
+                upvalues = closure.upvalues
+            elif op == GET_UPVALUE:
+                upvalue = upvalues[code[ip + 1]]
+                push(upvalue.cells[upvalue.index])
+                ip += 2
+            elif op == SET_UPVALUE:
+                upvalue = upvalues[code[ip + 1]]
+                upvalue.cells[upvalue.index] = stack[-1]
+                ip += 2
+            elif op == LOOP or op == JUMP:
+                ip = code[ip + 1]
+            elif op == INVOKE:
+                argCount = code[ip + 2]
+                ip += 3
+                target = self.invoke(
+                    constants[code[ip - 2]], argCount, chunk.tokens[ip - 2]
+                )
+                if target is not None:
+                    frames.append((closure, ip, base))
+                    closure = target
+                    chunk = closure.function.chunk
+                    code = chunk.code
+                    constants = chunk.constants
+                    upvalues = closure.upvalues
+                    base = len(stack) - argCount - 1
+                    ip = 0
+            elif op == GET_PROPERTY:
+                instance = stack[-1]
+                if not isinstance(instance, LoxInstance):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Only instances have properties."
+                    )
+                stack[-1] = instance.get(chunk.tokens[ip])
+                ip += 2
+            elif op == SET_PROPERTY:
+                value = pop()
+                instance = stack[-1]
+                if not isinstance(instance, LoxInstance):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Only instances have fields."
+                    )
+                instance.set(chunk.tokens[ip], value)
+                stack[-1] = value
+                ip += 2
+            elif op == GREATER:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, float) and isinstance(right, float)):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Operands must be numbers."
+                    )
+                stack[-1] = left > right
+                ip += 1
+            elif op == LESS_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, float) and isinstance(right, float)):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Operands must be numbers."
+                    )
+                stack[-1] = left <= right
+                ip += 1
+            elif op == GREATER_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, float) and isinstance(right, float)):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Operands must be numbers."
+                    )
+                stack[-1] = left >= right
+                ip += 1
+            elif op == MULTIPLY:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, float) and isinstance(right, float)):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Operands must be numbers."
+                    )
+                stack[-1] = left * right
+                ip += 1
+            elif op == DIVIDE:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, float) and isinstance(right, float)):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Operands must be numbers."
+                    )
+                stack[-1] = left / right
+                ip += 1
+            elif op == EQUAL:
+                right = pop()
+                stack[-1] = isEqual(stack[-1], right)
+                ip += 1
+            elif op == NOT_EQUAL:
+                right = pop()
+                stack[-1] = not isEqual(stack[-1], right)
+                ip += 1
+            elif op == NOT:
+                value = stack[-1]
+                stack[-1] = value is None or value is False
+                ip += 1
+            elif op == NEGATE:
+                value = stack[-1]
+                if not isinstance(value, float):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Operand must be a number"
+                    )
+                stack[-1] = -value
+                ip += 1
+            elif op == NIL:
+                push(None)
+                ip += 1
+            elif op == TRUE:
+                push(True)
+                ip += 1
+            elif op == FALSE:
+                push(False)
+                ip += 1
+            elif op == JUMP_IF_FALSE:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+            elif op == JUMP_IF_TRUE:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip += 2
+                else:
+                    ip = code[ip + 1]
+            elif op == SET_GLOBAL:
+                name = constants[code[ip + 1]]
+                if name not in globals:
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], f"Undefined variable '{name}.'"
+                    )
+                globals[name] = stack[-1]
+                ip += 2
+            elif op == DEFINE_GLOBAL:
+                globals[constants[code[ip + 1]]] = pop()
+                ip += 2
+            elif op == PRINT:
+                print(str(pop()))
+                ip += 1
+            elif op == CLOSURE:
+                function = constants[code[ip + 1]]
+                captured = []
+                ip += 2
+                for _ in range(function.upvalueCount):
+                    if code[ip]:
+                        captured.append(self.captureUpvalue(base + code[ip + 1]))
+                    else:
+                        captured.append(upvalues[code[ip + 1]])
+                    ip += 2
+                push(VMClosure(function, captured))
+            elif op == CLOSE_UPVALUE:
+                self.closeUpvalues(len(stack) - 1)
+                pop()
+                ip += 1
+            elif op == GET_SUPER:
+                superclass = pop()
+                name = constants[code[ip + 1]]
+                method = superclass.findMethod(name)
+                if method is None:
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], f"Undefined property '{name}'."
+                    )
+                stack[-1] = method.bind(stack[-1])
+                ip += 2
+            elif op == SUPER_INVOKE:
+                argCount = code[ip + 2]
+                ip += 3
+                superclass = pop()
+                target = self.invokeFromClass(
+                    superclass, constants[code[ip - 2]], argCount, chunk.tokens[ip - 2]
+                )
+                frames.append((closure, ip, base))
+                closure = target
+                chunk = closure.function.chunk
+                code = chunk.code
+                constants = chunk.constants
+                upvalues = closure.upvalues
+                base = len(stack) - argCount - 1
+                ip = 0
+            elif op == CLASS:
+                name = constants[code[ip + 1]]
+                methodCount = code[ip + 2]
+                methods = {}
+                if methodCount:
+                    for method in stack[-methodCount:]:
+                        methods[method.function.name] = method
+                    del stack[-methodCount:]
+                superclass = stack[-1] if code[ip + 3] else None
+                push(LoxClass(name, superclass, methods))
+                ip += 4
+            elif op == INHERIT:
+                if not isinstance(stack[-1], LoxClass):
+                    raise CustomRuntimeError(
+                        chunk.tokens[ip], "Superclass must be a class."
+                    )
+                ip += 1